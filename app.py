@@ -7,21 +7,62 @@ from collections import deque
 import subprocess
 import time
 import sys
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _detect_core(gray, mask, bg_model, fgmask, alpha_q8, threshold):
+        """Running-mean background update + masked threshold, returns the foreground pixel count
+
+        bg_model is uint16 8.8 fixed point and alpha_q8 is the learning rate * 256
+        """
+        height, width = gray.shape
+        threshold_q8 = threshold << 8
+        row_counts = np.zeros(height, dtype=np.int64)
+        for y in prange(height):
+            count = 0
+            for x in range(width):
+                model = np.int32(bg_model[y, x])
+                diff = (np.int32(gray[y, x]) << 8) - model
+                bg_model[y, x] = model + ((diff * alpha_q8) >> 8)
+                if mask[y, x] != 0 and abs(diff) > threshold_q8:
+                    fgmask[y, x] = 255
+                    count += 1
+                else:
+                    fgmask[y, x] = 0
+            row_counts[y] = count
+        return row_counts.sum()
+else:
+    _detect_core = None
 
 class MotionAnalyzer:
     def __init__(self):
-        # Background subtractor with parameters tuned for heat haze
-        self.fgbg = cv2.createBackgroundSubtractorKNN(
-            history=500,
-            dist2Threshold=1200,
-            detectShadows=False
-        )
+        # Running-mean background model with parameters tuned for heat haze
+        # (a fixed camera doesn't need KNN's multimodal per-pixel samples)
+        self.bg_learning_rate = 0.01
+        self.bg_threshold = 30  # Min |frame - mean| for a foreground pixel
+        self._bg_model = None  # Background mean, allocated on the first frame
 
         # Motion validation parameters
-        self.min_contour_area = 1500  # Minimum contour area to consider
-        self.motion_buffer = deque(maxlen=5)  # Stores recent motion states
+        # Detection runs on a 2x pyrDown'd frame, so areas and kernel sizes are in half-res pixels
+        self.min_contour_area = 1500 // 4  # Minimum contour area to consider
         self.required_consecutive = 5  # Frames needed to confirm motion
-        self.heat_haze_kernel_size = 25
+        # Recent motion states, one bit per frame (newest in bit 0)
+        self._motion_bits = 0
+        self._motion_mask = (1 << self.required_consecutive) - 1
+        self.heat_haze_kernel_size = 13  # 25 at full resolution
+        # 1D Gaussian taps, applied as a row pass + column pass (K + K instead of K*K)
+        self._gk = cv2.getGaussianKernel(self.heat_haze_kernel_size, 0)
+        # Morphology SEs, built once instead of every frame
+        self._morph_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (7, 7))
+        self._wide_morph_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (13, 13))
+        # With an NVIDIA GPU the whole pipeline runs in cv2.cuda and only the final mask comes back
+        self._use_cuda = hasattr(cv2, 'cuda') and cv2.cuda.getCudaEnabledDeviceCount() > 0
+        # Without OpenCL the UMat path runs on the CPU anyway, so fuse the background step in numba
+        self._use_numba = not self._use_cuda and _detect_core is not None and not cv2.ocl.haveOpenCL()
         # Video clip parameters
         self.clip_before = 1.0  # Seconds to include before motion
         self.clip_after = 2.0  # Seconds to include after motion
@@ -29,7 +70,7 @@ class MotionAnalyzer:
 
         # Tracking state
         self.is_recording = False
-        self.clip_frames = []
+        self.clip_writer = None
         self.clip_start_time = None
         self.last_motion_time = None
         self.frame_buffer = deque()  # Stores frames for pre-motion recording
@@ -43,38 +84,194 @@ class MotionAnalyzer:
         cv2.circle(mask, center, self.mask_radius, 255, -1)
         return mask
 
-    def detect_significant_motion(self, frame):
+    def _init_buffers(self, frame):
+        """Allocate the mask and the reusable buffers (UMats, or plain arrays for numba) on the first frame"""
+        frame_height, frame_width = frame.shape[:2]
+        # Only the bounding box of the circle is ever processed, the corners are masked anyway
+        cx, cy = frame_width // 2, frame_height // 2
+        y0, y1 = max(cy - self.mask_radius, 0), min(cy + self.mask_radius, frame_height)
+        x0, x1 = max(cx - self.mask_radius, 0), min(cx + self.mask_radius, frame_width)
+        self._roi = (y0, y1, x0, x1)
+        height, width = y1 - y0, x1 - x0
+        small_height, small_width = (height + 1) // 2, (width + 1) // 2
+        mask = self._create_circular_mask(frame)[y0:y1, x0:x1]
+        mask = cv2.resize(mask, (small_width, small_height), interpolation=cv2.INTER_NEAREST)
+        if self._use_cuda:
+            self._init_cuda_buffers(mask)
+            return
+        if self._use_numba:
+            alloc = lambda h, w: np.empty((h, w), dtype=np.uint8)
+        else:
+            alloc = lambda h, w: cv2.UMat(h, w, cv2.CV_8UC1)
+        self._gray = alloc(height, width)
+        # Everything after the pyrDown works on the half-resolution frame
+        self._small_gray = alloc(small_height, small_width)
+        self._blurred = alloc(small_height, small_width)
+        self._fgmask = alloc(small_height, small_width)
+        if not self._use_numba:
+            self._bg_u8 = alloc(small_height, small_width)
+            self._diff = alloc(small_height, small_width)
+        # The mask is 255 inside the circle, so AND-ing with it is the masked copy
+        self.circular_mask = mask if self._use_numba else cv2.UMat(mask)
+
+    def _init_cuda_buffers(self, mask):
+        """Upload the mask and build the cv2.cuda filter objects once"""
+        self.circular_mask = cv2.cuda_GpuMat()
+        self.circular_mask.upload(mask)
+        self._gpu_frame = cv2.cuda_GpuMat()
+        self._gpu_blur = cv2.cuda.createGaussianFilter(
+            cv2.CV_8UC1, cv2.CV_8UC1, (self.heat_haze_kernel_size, self.heat_haze_kernel_size), 0)
+        self._gpu_bgsub = cv2.cuda.createBackgroundSubtractorMOG2(
+            history=int(1 / self.bg_learning_rate), varThreshold=16, detectShadows=False)
+        self._gpu_erode = cv2.cuda.createMorphologyFilter(cv2.MORPH_ERODE, cv2.CV_8UC1, self._morph_kernel)
+        self._gpu_dilate = cv2.cuda.createMorphologyFilter(cv2.MORPH_DILATE, cv2.CV_8UC1, self._wide_morph_kernel)
+        self._gpu_stream = cv2.cuda_Stream()
+
+    def _find_significant_motion_cuda(self, frame):
+        """GPU version of _find_significant_motion, same stages with MOG2 as the background model"""
+        y0, y1, x0, x1 = self._roi
+        stream = self._gpu_stream
+        self._gpu_frame.upload(np.ascontiguousarray(frame[y0:y1, x0:x1]), stream)
+        gray = cv2.cuda.cvtColor(self._gpu_frame, cv2.COLOR_BGR2GRAY, stream=stream)
+        small = cv2.cuda.pyrDown(gray, stream=stream)
+        blurred = self._gpu_blur.apply(small, stream=stream)
+        fgmask = self._gpu_bgsub.apply(blurred, -1, stream)
+        fgmask = cv2.cuda.bitwise_and(fgmask, self.circular_mask, stream=stream)
+        fgmask = self._gpu_erode.apply(fgmask, stream=stream)
+        fgmask = self._gpu_dilate.apply(fgmask, stream=stream)
+        fgmask = self._gpu_erode.apply(fgmask, stream=stream)
+        stream.waitForCompletion()
+        # Only pay for the download when there are enough pixels for a blob
+        if cv2.cuda.countNonZero(fgmask) <= self.min_contour_area:
+            return False
+        _, _, stats, _ = cv2.connectedComponentsWithStats(fgmask.download(), connectivity=8)
+        return bool((stats[1:, cv2.CC_STAT_AREA] > self.min_contour_area).any())
+
+    def _find_significant_motion(self, frame):
+        """Run the detection pipeline on one frame, True if it contains a large enough blob"""
         if self.circular_mask is None:
-            self.circular_mask = self._create_circular_mask(frame)
+            self._init_buffers(frame)
+        if self._use_cuda:
+            return self._find_significant_motion_cuda(frame)
+        # Everything below writes into the preallocated buffers; on the T-API path
+        # they are UMats so OpenCV can dispatch to OpenCL/SIMD without per-stage allocations
+        y0, y1, x0, x1 = self._roi
+        src = frame[y0:y1, x0:x1] if self._use_numba else cv2.UMat(frame[y0:y1, x0:x1])
         # Preprocessing to reduce heat haze effects
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        blurred = cv2.GaussianBlur(gray, (self.heat_haze_kernel_size, self.heat_haze_kernel_size), 0)
-        blurred = cv2.bitwise_and(blurred, blurred, mask=self.circular_mask)
-        # Background subtraction
-        fgmask = self.fgbg.apply(blurred)
-
-        # Morphological operations to reduce noise
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
-        fgmask = cv2.morphologyEx(fgmask, cv2.MORPH_OPEN, kernel)
-        fgmask = cv2.morphologyEx(fgmask, cv2.MORPH_CLOSE, kernel)
-
-        # Find contours
-        contours, _ = cv2.findContours(fgmask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        # Check for significant contours
-        significant_motion = False
-        for contour in contours:
-            if cv2.contourArea(contour) > self.min_contour_area:
-                significant_motion = True
-                break
+        cv2.cvtColor(src, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        cv2.pyrDown(self._gray, dst=self._small_gray)
+        cv2.sepFilter2D(self._small_gray, cv2.CV_8U, self._gk, self._gk, dst=self._blurred)
+        if self._bg_model is None:
+            if self._use_numba:
+                # 8.8 fixed point: half the bandwidth of a float32 model, still fine enough for alpha=0.01
+                self._bg_model = self._blurred.astype(np.uint16) << 8
+            else:
+                self._bg_model = cv2.UMat(self._blurred.get().astype(np.float32))
+        if self._use_numba:
+            # Background update, threshold and mask in one parallel pass
+            fg_count = _detect_core(self._blurred, self.circular_mask, self._bg_model, self._fgmask,
+                                    max(1, round(self.bg_learning_rate * 256)), self.bg_threshold)
+            # Too few foreground pixels to ever form a significant blob
+            if fg_count <= self.min_contour_area:
+                return False
+        else:
+            # Background subtraction against the running mean, then fold the frame into it
+            cv2.convertScaleAbs(self._bg_model, dst=self._bg_u8)
+            cv2.absdiff(self._blurred, self._bg_u8, dst=self._diff)
+            cv2.threshold(self._diff, self.bg_threshold, 255, cv2.THRESH_BINARY, dst=self._fgmask)
+            cv2.accumulateWeighted(self._blurred, self._bg_model, self.bg_learning_rate)
+            # Zero out the corners on the 1-byte foreground mask rather than on the dense blurred frame
+            cv2.bitwise_and(self._fgmask, self.circular_mask, dst=self._fgmask)
+
+        # Morphological operations to reduce noise: OPEN then CLOSE is erode, dilate, dilate, erode,
+        # and the two middle dilates fuse into one with a 13x13 rect. Rect SEs take OpenCV's
+        # separable row+column path, so each pass costs 2K instead of K*K
+        cv2.erode(self._fgmask, self._morph_kernel, dst=self._fgmask)
+        cv2.dilate(self._fgmask, self._wide_morph_kernel, dst=self._fgmask)
+        cv2.erode(self._fgmask, self._morph_kernel, dst=self._fgmask)
+
+        # Cheap reduction first: with fewer foreground pixels than the minimum area
+        # no blob can pass, so most quiet frames skip the download and labelling
+        if cv2.countNonZero(self._fgmask) <= self.min_contour_area:
+            return False
+
+        # Label blobs (download the final mask once, areas don't depend on the crop offset)
+        fgmask = self._fgmask if self._use_numba else self._fgmask.get()
+        _, _, stats, _ = cv2.connectedComponentsWithStats(fgmask, connectivity=8)
+
+        # Check for significant blobs (label 0 is the background)
+        return bool((stats[1:, cv2.CC_STAT_AREA] > self.min_contour_area).any())
+
+    def detect_significant_motion(self, frame):
+        significant_motion = self._find_significant_motion(frame)
 
         # Update motion buffer
-        self.motion_buffer.append(significant_motion)
+        self._motion_bits = ((self._motion_bits << 1) | significant_motion) & self._motion_mask
 
         # Check for consecutive motion frames
-        if len(self.motion_buffer) >= self.required_consecutive:
-            return all(self.motion_buffer)
-        return False
+        return self._motion_bits == self._motion_mask
+
+class FrameRing:
+    """Preallocated ring of frames used as the pre-motion buffer, frames are decoded straight into it"""
+    def __init__(self, size, shape):
+        self.size = max(1, size)
+        self.frames = np.empty((self.size,) + shape, dtype=np.uint8)
+        self.head = 0
+        self.count = 0
+
+    def next_slot(self):
+        """Slot the next frame should be decoded into (overwrites the oldest one)"""
+        return self.frames[self.head]
+
+    def advance(self):
+        """Mark the slot returned by next_slot as filled"""
+        self.head = (self.head + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def ordered(self):
+        """Views of the buffered frames, oldest first (only valid until the next decode)"""
+        if self.count < self.size:
+            return list(self.frames[:self.count])
+        return list(self.frames[self.head:]) + list(self.frames[:self.head])
+
+class FFmpegCapture:
+    """Reads raw BGR frames from an ffmpeg pipe, with the same read/isOpened/release API as VideoCapture"""
+    def __init__(self, url, width, height, fps):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.process = subprocess.Popen([
+            'ffmpeg',
+            '-loglevel', 'error',
+            '-hwaccel', 'auto',  # NVDEC/VAAPI/... when available, software otherwise
+            '-i', url,
+            '-f', 'rawvideo',
+            '-pix_fmt', 'bgr24',
+            '-'
+        ], stdout=subprocess.PIPE, bufsize=1 << 22)
+        # Default target buffer, reused every frame unless the caller passes its own
+        self.frame = np.empty((height, width, 3), dtype=np.uint8)
+
+    def isOpened(self):
+        return self.process.poll() is None
+
+    def read(self, out=None):
+        """Decode the next frame into out (or the internal buffer), without allocating"""
+        frame = self.frame if out is None else out
+        view = memoryview(frame).cast('B')
+        filled = 0
+        while filled < len(view):
+            n = self.process.stdout.readinto(view[filled:])
+            if not n:
+                return False, None
+            filled += n
+        return True, frame
+
+    def release(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.stdout.close()
+        self.process.wait()
 
 def get_youtube_stream(url, resolution='720p'):
 
@@ -87,7 +284,7 @@ def get_youtube_stream(url, resolution='720p'):
             info = ydl.extract_info(url, download=False)
             stream_url = info['url']
 
-        cap = cv2.VideoCapture(stream_url)
+        cap = FFmpegCapture(stream_url, info['width'], info['height'], info.get('fps') or 30)
         return cap
 
     except Exception as e:
@@ -99,43 +296,52 @@ def get_youtube_stream(url, resolution='720p'):
         # For other errors, re-raise them
         raise
 
-def save_video_clip(frames, fps, output_dir, timestamp):
-    if not frames:
-        return
-
-    # Create output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)
-
-    # Format filename with timestamp
-    filename = f"motion_{timestamp.strftime('%Y%m%d_%H%M%S')}.mp4"
-    output_path = os.path.join(output_dir, filename)
-
-    # Get frame size from first frame
-    height, width = frames[0].shape[:2]
-
-    # Write video using FFmpeg (more efficient than OpenCV's VideoWriter)
-    process = subprocess.Popen([
-        'ffmpeg',
-        '-y',  # Overwrite without asking
-        '-f', 'rawvideo',
-        '-vcodec', 'rawvideo',
-        '-s', f'{width}x{height}',
-        '-pix_fmt', 'bgr24',
-        '-r', str(fps),
-        '-i', '-',
-        '-c:v', 'libx264',
-        '-preset', 'fast',
-        '-crf', '23',
-        output_path
-    ], stdin=subprocess.PIPE)
-
-    for frame in frames:
-        process.stdin.write(frame.tobytes())
-
-    process.stdin.close()
-    process.wait()
-
-    return output_path
+class ClipWriter:
+    """ffmpeg encoder that is fed frame by frame while a clip is being recorded"""
+    def __init__(self, fps, output_dir, timestamp, width, height):
+        # Create output directory if it doesn't exist
+        os.makedirs(output_dir, exist_ok=True)
+
+        # Format filename with timestamp
+        filename = f"motion_{timestamp.strftime('%Y%m%d_%H%M%S')}.mp4"
+        self.output_path = os.path.join(output_dir, filename)
+        # Encode under a temporary name so app1.py never picks up a half-written clip
+        self.temp_path = self.output_path + '.part'
+
+        # Write video using FFmpeg (more efficient than OpenCV's VideoWriter)
+        self.process = subprocess.Popen([
+            'ffmpeg',
+            '-y',  # Overwrite without asking
+            '-f', 'rawvideo',
+            '-vcodec', 'rawvideo',
+            '-s', f'{width}x{height}',
+            '-pix_fmt', 'bgr24',
+            '-r', str(fps),
+            '-i', '-',
+            '-c:v', 'libx264',
+            '-preset', 'fast',
+            '-crf', '23',
+            '-f', 'mp4',
+            self.temp_path
+        ], stdin=subprocess.PIPE, bufsize=1 << 22)
+
+    def write(self, frame):
+        # ndarrays expose the buffer protocol, so write them without a tobytes() copy
+        self.process.stdin.write(memoryview(frame))
+
+    def close(self, keep=True):
+        """Finish encoding, then either publish the clip under its final name or discard it"""
+        try:
+            self.process.stdin.close()  # Flushes the pipe buffer
+        except BrokenPipeError:
+            keep = False  # ffmpeg already died, whatever it wrote is incomplete
+        self.process.wait()
+        if keep and self.process.returncode == 0:
+            os.replace(self.temp_path, self.output_path)
+            return self.output_path
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+        return None
 
 def main():
     # Configuration
@@ -147,16 +353,17 @@ def main():
     while True:
         # Initialize
         cap = get_youtube_stream(youtube_url)
-        fps = cap.get(cv2.CAP_PROP_FPS)
+        fps = cap.fps
         analyzer = MotionAnalyzer()
-        frame_buffer = deque(maxlen=int(fps * analyzer.clip_before))
+        frame_buffer = FrameRing(int(fps * analyzer.clip_before), (cap.height, cap.width, 3))
 
         print(f"Starting stream analysis at {datetime.datetime.now()}")
         print(f"Stream FPS: {fps}")
 
         try:
             while cap.isOpened():
-                ret, frame = cap.read()
+                # Decode straight into the pre-motion ring, no per-frame copy
+                ret, frame = cap.read(frame_buffer.next_slot())
                 if not ret:
                     print("Stream ended or connection lost")
                     break
@@ -164,7 +371,7 @@ def main():
                 current_time = datetime.datetime.now()
 
                 # Store frame in buffer
-                frame_buffer.append(frame.copy())
+                frame_buffer.advance()
 
                 # Detect motion
                 has_motion = analyzer.detect_significant_motion(frame)
@@ -174,33 +381,31 @@ def main():
                         # Start new clip
                         analyzer.is_recording = True
                         analyzer.clip_start_time = current_time
-                        analyzer.clip_frames = list(frame_buffer)  # Include pre-motion frames
+                        analyzer.clip_writer = ClipWriter(
+                            fps, output_directory, current_time, cap.width, cap.height)
+                        # Include pre-motion frames (the buffer already ends with the current one)
+                        for buffered in frame_buffer.ordered():
+                            analyzer.clip_writer.write(buffered)
                         print(f"Motion detected at {current_time}")
-
-                    # Add current frame to clip
-                    analyzer.clip_frames.append(frame.copy())
+                    else:
+                        # Add current frame to clip
+                        analyzer.clip_writer.write(frame)
                     analyzer.last_motion_time = current_time
                 else:
                     if analyzer.is_recording:
                         # Add current frame to clip (continue briefly after motion stops)
-                        analyzer.clip_frames.append(frame.copy())
+                        analyzer.clip_writer.write(frame)
 
                         # Check if we should end the clip
                         if (current_time - analyzer.last_motion_time).total_seconds() > analyzer.clip_after:
                             # Save clip if it meets minimum length
                             clip_length = (current_time - analyzer.clip_start_time).total_seconds()
-                            if clip_length >= analyzer.min_clip_length:
-                                save_video_clip(
-                                    analyzer.clip_frames,
-                                    fps,
-                                    output_directory,
-                                    analyzer.clip_start_time
-                                )
+                            if analyzer.clip_writer.close(keep=clip_length >= analyzer.min_clip_length):
                                 print(f"Saved clip: {clip_length:.2f} seconds")
 
                             # Reset recording state
                             analyzer.is_recording = False
-                            analyzer.clip_frames = []
+                            analyzer.clip_writer = None
 
                 # Display preview (optional)
                 #cv2.imshow('Stream Preview', frame)
@@ -217,15 +422,9 @@ def main():
             #cv2.destroyAllWindows()
 
             # Save any pending clip when stopping
-            if analyzer.is_recording and analyzer.clip_frames:
+            if analyzer.is_recording and analyzer.clip_writer:
                 clip_length = (datetime.datetime.now() - analyzer.clip_start_time).total_seconds()
-                if clip_length >= analyzer.min_clip_length:
-                    save_video_clip(
-                        analyzer.clip_frames,
-                        fps,
-                        output_directory,
-                        analyzer.clip_start_time
-                    )
+                if analyzer.clip_writer.close(keep=clip_length >= analyzer.min_clip_length):
                     print(f"Saved final clip: {clip_length:.2f} seconds")
 
 if __name__ == "__main__":
@@ -28,13 +28,15 @@ TEXT_FILE = "/home/art3m1sf0wl/program/street_cars/video_titles.txt"
 DESCRIPTION_FILE = "/home/art3m1sf0wl/program/street_cars/description.txt"
 LINK_FILE = "/home/art3m1sf0wl/program/street_cars/list.txt"  # File to store YouTube links
 logger = logging.getLogger(__name__)
+_creds_cache = None  # Credentials from the last call, reused while the process is alive
 
 def get_authenticated_service():
     """Authenticate and return the YouTube service, caching credentials"""
-    creds = None
+    global _creds_cache
+    creds = _creds_cache
 
-    # Load existing credentials if available
-    if os.path.exists(TOKEN_FILE):
+    # Load existing credentials if available (only needed on the first call)
+    if creds is None and os.path.exists(TOKEN_FILE):
         try:
             creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
         except Exception as e:
@@ -49,7 +51,9 @@ def get_authenticated_service():
                 creds.refresh(Request())
             except RefreshError as e:
                 logger.error(f"Failed to refresh token: {e}")
-                os.remove(TOKEN_FILE)  # Remove invalid token
+                _creds_cache = None
+                if os.path.exists(TOKEN_FILE):
+                    os.remove(TOKEN_FILE)  # Remove invalid token
                 return get_authenticated_service()  # Retry with new auth flow
         else:
             flow = InstalledAppFlow.from_client_secrets_file(
@@ -62,6 +66,7 @@ def get_authenticated_service():
         with open(TOKEN_FILE, 'w') as token:
             token.write(creds.to_json())
 
+    _creds_cache = creds
     return build(YOUTUBE_API_SERVICE_NAME, YOUTUBE_API_VERSION, credentials=creds)
 
 def save_youtube_link(video_id, title, timestamp):
@@ -78,13 +83,29 @@ def save_youtube_link(video_id, title, timestamp):
     except Exception as e:
         print(f"Error saving YouTube link to file: {e}")
 
-def create_black_clip(duration, output_path):
+def probe_video(path):
+    """Return the stream parameters that have to match for a stream-copy concat"""
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'stream=codec_name,width,height,pix_fmt,r_frame_rate',
+        '-of', 'json',
+        path
+    ]
+    result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+    stream = json.loads(result.stdout)['streams'][0]
+    return (stream['codec_name'], stream['width'], stream['height'], stream['pix_fmt'], stream['r_frame_rate'])
+
+def create_black_clip(duration, output_path, width=1920, height=1080):
     """Create a short black video clip with proper timing"""
     cmd = [
         'ffmpeg',
         '-f', 'lavfi',
-        '-i', 'color=c=black:s=1920x1080:r=30',  # 30 FPS
+        '-i', f'color=c=black:s={width}x{height}:r=30',  # 30 FPS
         '-t', str(duration/30.0),  # Convert frames to seconds
+        # Same x264 settings as add_text_to_video, so the black clip can be stream-copied
+        # between the processed clips
         '-c:v', 'libx264',
         '-preset', 'fast',
         '-crf', '18',
@@ -117,61 +138,80 @@ def add_text_to_video(input_path, output_path, text):
 
 def combine_videos(video_files, output_file):
     """Combine videos with black frames in between, ensuring consistent frame rate"""
-    # First, ensure all videos have the same frame rate and format
+    # Clips that all went through add_text_to_video share the same encoder params,
+    # in which case they can be concatenated as-is
+    params = [probe_video(video) for video in video_files]
+    stream_copy = len(set(params)) == 1 and params[0][0] == 'h264'
     normalized_files = []
-    
-    for i, video in enumerate(video_files):
-        normalized_path = f"normalized_{i}.mp4"
-        
-        # Normalize each video to 30fps with consistent encoding
-        cmd = [
-            'ffmpeg',
-            '-i', video,
-            '-r', '30',  # Force 30 FPS
-            '-c:v', 'libx264',
-            '-preset', 'fast',
-            '-crf', '18',
-            '-pix_fmt', 'yuv420p',
-            '-y',  # Overwrite without asking
-            normalized_path
-        ]
-        subprocess.run(cmd, check=True)
-        normalized_files.append(normalized_path)
-    
+    temp_files = []
+
+    if stream_copy:
+        normalized_files = list(video_files)
+        width, height = params[0][1], params[0][2]
+    else:
+        width, height = 1920, 1080
+        for i, video in enumerate(video_files):
+            normalized_path = f"normalized_{i}.mp4"
+
+            # Normalize each video to 30fps with consistent encoding
+            cmd = [
+                'ffmpeg',
+                '-i', video,
+                '-r', '30',  # Force 30 FPS
+                '-c:v', 'libx264',
+                '-preset', 'fast',
+                '-crf', '18',
+                '-pix_fmt', 'yuv420p',
+                '-y',  # Overwrite without asking
+                normalized_path
+            ]
+            subprocess.run(cmd, check=True)
+            normalized_files.append(normalized_path)
+            temp_files.append(normalized_path)
+
+    # The black gap is identical every time, so encode it once and reference it between clips
+    black_clip = "black.mp4"
+    if len(normalized_files) > 1:
+        create_black_clip(BLACK_FRAME_DURATION, black_clip, width, height)
+        temp_files.append(black_clip)
+        if stream_copy and probe_video(black_clip) != params[0]:
+            stream_copy = False  # Black clip doesn't match the inputs, re-encode the concat
+
     # Create a text file for ffmpeg concat
     with open('concat_list.txt', 'w') as f:
         for i, video in enumerate(normalized_files):
             f.write(f"file '{video}'\n")
             # Add black clip after each video except the last one
             if i < len(normalized_files) - 1:
-                black_clip = f"black_{i}.mp4"
-                create_black_clip(BLACK_FRAME_DURATION, black_clip)
                 f.write(f"file '{black_clip}'\n")
-    
-    # Combine all videos with re-encoding to ensure consistent timing
+
+    if stream_copy:
+        # Inputs and black clips share codec/size/rate, just remux
+        codec_args = ['-c', 'copy']
+    else:
+        # Combine all videos with re-encoding to ensure consistent timing
+        codec_args = [
+            '-r', '30',  # Force output to 30 FPS
+            '-c:v', 'libx264',
+            '-preset', 'fast',
+            '-crf', '18',
+            '-pix_fmt', 'yuv420p',
+        ]
     cmd = [
         'ffmpeg',
         '-f', 'concat',
         '-safe', '0',
         '-i', 'concat_list.txt',
-        '-r', '30',  # Force output to 30 FPS
-        '-c:v', 'libx264',
-        '-preset', 'fast',
-        '-crf', '18',
-        '-pix_fmt', 'yuv420p',
+        *codec_args,
         '-y',
         output_file
     ]
     subprocess.run(cmd, check=True)
-    
+
     # Clean up temporary files
-    for normalized in normalized_files:
-        if os.path.exists(normalized):
-            os.remove(normalized)
-    for i in range(len(normalized_files) - 1):
-        black_clip = f"black_{i}.mp4"
-        if os.path.exists(black_clip):
-            os.remove(black_clip)
+    for temp in temp_files:
+        if os.path.exists(temp):
+            os.remove(temp)
     if os.path.exists('concat_list.txt'):
         os.remove('concat_list.txt')
 
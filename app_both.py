@@ -1,11 +1,13 @@
 import threading
 import time
 import logging
-from flask import Flask, Response, render_template_string, request, redirect, url_for, g
+from flask import Flask, Response, request, redirect, url_for, g, send_file
 from functools import wraps
 import socket
+import struct
 import collections
-from typing import Dict, Set
+from typing import Dict, Tuple
+from urllib.parse import quote
 import cv2
 import numpy as np
 import datetime
@@ -13,76 +15,188 @@ import os
 import subprocess
 import sys
 import av
+from fractions import Fraction
 import io
 import hashlib
+import gzip
+import re
+import hmac
 import secrets
 import bcrypt
-import json
+import orjson
+import cachetools
+import brotli
+from jinja2 import Environment, DictLoader, FileSystemBytecodeCache
+import queue
+import atexit
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Create logs directory once, every log file lives in it
+LOG_DIR = 'logs'
+os.makedirs(LOG_DIR, exist_ok=True)
+
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(16)  # Required for session management
+app.secret_key = os.urandom(32)  # Required for session management
+
+class BatchingFileHandler(logging.Handler):
+    """File handler writing through a 64K buffer, flushed every N records or flush_interval seconds"""
+    def __init__(self, filename, flush_every=100, flush_interval=1.0):
+        super().__init__()
+        self.stream = io.open(filename, 'a', buffering=64 * 1024, encoding='utf-8')
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + '\n')
+        except Exception:
+            self.handleError(record)
+            return
+        self.pending += 1
+        if self.pending >= self.flush_every or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.stream.flush()
+            self.pending = 0
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.stream.close()
+        super().close()
+
+class BufferedQueueListener(QueueListener):
+    """QueueListener that flushes its handlers whenever the queue has been idle for flush_interval"""
+    def __init__(self, log_queue, *handlers, flush_interval=1.0, respect_handler_level=False):
+        super().__init__(log_queue, *handlers, respect_handler_level=respect_handler_level)
+        self.flush_interval = flush_interval
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, timeout=self.flush_interval)
+            except queue.Empty:
+                for handler in self.handlers:
+                    handler.flush()
+
+_last_log_second = 0
+_last_log_timestamp = ''
+
+def now_iso():
+    """Local time as ISO 8601 at second resolution, formatted once per second"""
+    global _last_log_second, _last_log_timestamp
+    second = int(time.time())
+    if second != _last_log_second:
+        # Two threads may both reformat the same second, which is harmless
+        _last_log_timestamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(second))
+        _last_log_second = second
+    return _last_log_timestamp
+
+def get_client_ip():
+    """First hop of X-Forwarded-For (or the peer address), without splitting the whole header"""
+    client_ip = request.headers.get('X-Forwarded-For', request.remote_addr)
+    first, sep, _ = client_ip.partition(',')
+    return first.strip() if sep else client_ip.strip()
+
+def _trim_args(args, max_keys=16, max_val=256):
+    """Query params for the logs, capped in key count and value length"""
+    if not request.query_string:
+        return {}
+    trimmed = {}
+    for key, value in args.items():
+        if len(trimmed) >= max_keys:
+            break
+        trimmed[key] = value[:max_val] + '…' if len(value) > max_val else value
+    return trimmed
+
+class JsonFormatter(logging.Formatter):
+    """Serializes the record's data dict with orjson, runs in the listener thread instead of the request thread"""
+    # Logger name -> value of the 'stream' field in the combined log
+    STREAMS = {
+        'access_logger': 'access',
+        'security_logger': 'security',
+    }
+
+    def format(self, record):
+        return orjson.dumps({
+            'stream': self.STREAMS.get(record.name, record.name),
+            'level': record.levelname,
+            **record.data
+        }).decode()
 
 class RequestLogger:
-    def __init__(self, app, log_file='app_access.log'):
+    def __init__(self, app, log_file='app.jsonl'):
         self.app = app
         self.logger = logging.getLogger('access_logger')
         self.logger.setLevel(logging.INFO)
         
-        # Create logs directory if it doesn't exist
-        log_dir = 'logs'
-        os.makedirs(log_dir, exist_ok=True)
+        # One structured JSON log for access and security records: a single file handler,
+        # owned by a background listener so request threads only enqueue
+        fh = BatchingFileHandler(os.path.join(LOG_DIR, log_file))
+        fh.setFormatter(JsonFormatter())
         
-        # File handler
-        fh = logging.FileHandler(os.path.join(log_dir, log_file))
-        fh.setLevel(logging.INFO)
+        log_queue = queue.SimpleQueue()
+        self.listener = BufferedQueueListener(log_queue, fh)
+        self.listener.start()
+        # stop() drains the queue and closes (flushes) the handler
+        atexit.register(self.stop)
         
-        # Formatter
-        formatter = logging.Formatter(
-            '%(asctime)s | %(levelname)s | %(message)s'
-        )
-        fh.setFormatter(formatter)
-        
-        self.logger.addHandler(fh)
+        # Shared by every logger that writes to the structured log
+        self.queue_handler = QueueHandler(log_queue)
+        self.logger.addHandler(self.queue_handler)
+        self.logger.propagate = False
         
         # Register before and after request handlers
         self.app.before_request(self.before_request)
         self.app.after_request(self.after_request)
     
+    def stop(self):
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+    
     def before_request(self):
         g.start_time = time.time()
+        
+        # Per-request values shared by every log site, computed once
+        g.client_ip = get_client_ip()
+        g.user_agent = request.headers.get('User-Agent', 'Unknown')
+        session_id = request.cookies.get('session_id')
+        g.session = get_session(session_id) if session_id else None
+        if g.session:
+            g.username = g.session.get('username', 'Unknown')
+            g.role = g.session.get('role', 'Unknown')
+        else:
+            g.username = 'Anonymous'
+            g.role = 'None'
     
     def after_request(self, response):
+        if not self.logger.isEnabledFor(logging.INFO):
+            return response
+        
         # Calculate request duration
         duration = time.time() - g.start_time
         
-        # Get client information
-        client_ip = request.headers.get('X-Forwarded-For', request.remote_addr)
-        if ',' in client_ip:
-            client_ip = client_ip.split(',')[0].strip()
-        
-        # Get user agent
-        user_agent = request.headers.get('User-Agent', 'Unknown')
-        
         # Get referrer
         referrer = request.headers.get('Referer', 'No referrer')
         
-        # Get authentication info
-        username = 'Anonymous'
-        role = 'None'
-        session_id = request.cookies.get('session_id')
-        
-        if session_id and session_id in sessions:
-            username = sessions[session_id].get('username', 'Unknown')
-            role = sessions[session_id].get('role', 'Unknown')
+        # Client and authentication info come from before_request
+        username = g.username
         
         # Build log message
         log_data = {
-            'timestamp': datetime.datetime.now().isoformat(),
-            'client_ip': client_ip,
+            'timestamp': now_iso(),
+            'client_ip': g.client_ip,
             'method': request.method,
             'url': request.url,
             'path': request.path,
@@ -90,152 +204,52 @@ class RequestLogger:
             'status_code': response.status_code,
             'response_size': response.content_length or 0,
             'duration_seconds': round(duration, 3),
-            'user_agent': user_agent,
+            'user_agent': g.user_agent,
             'referrer': referrer,
             'username': username,
-            'role': role,
-            'query_params': dict(request.args),
-            'user_authenticated': AUTH_CONFIG.get('enabled', False) and username != 'Anonymous'
+            'role': g.role,
+            'query_params': _trim_args(request.args),
+            'user_authenticated': AUTH_ENABLED and username != 'Anonymous'
         }
         
-        # Log the request
-        self.logger.info(json.dumps(log_data))
+        # Log the request (serialized by JsonFormatter in the listener thread)
+        self.logger.info('', extra={'data': log_data})
         
         return response
 
 
-# Simple logging decorator (this function is deprecated, kept only for legacy users)
+# Simple logging decorator (this function is deprecated, kept only for legacy users).
+# RequestLogger already logs every request, so this is now a no-op kept for old decorations
 def log_access(original_func):
-    @wraps(original_func)
-    def decorated_function(*args, **kwargs):
-        start_time = time.time()
-        
-        # Get client info before processing
-        client_ip = request.headers.get('X-Forwarded-For', request.remote_addr)
-        if ',' in client_ip:
-            client_ip = client_ip.split(',')[0].strip()
-        
-        user_agent = request.headers.get('User-Agent', 'Unknown')
-        
-        # Get user info
-        username = 'Anonymous'
-        session_id = request.cookies.get('session_id')
-        if session_id and session_id in sessions:
-            username = sessions[session_id].get('username', 'Unknown')
-        
-        # Process the request by calling the original function
-        try:
-            response = original_func(*args, **kwargs)
-            
-            # Calculate duration
-            duration = time.time() - start_time
-            
-            # Handle different response types
-            status_code = 200  # default
-            content_length = 0
-            
-            if hasattr(response, 'status_code'):
-                # It's a Response object
-                status_code = response.status_code
-                content_length = response.content_length or 0
-            elif isinstance(response, tuple) and len(response) >= 2:
-                # It's a tuple like (response, status) or (response, status, headers)
-                status_code = response[1]
-                if hasattr(response[0], '__len__'):
-                    content_length = len(response[0])
-            elif isinstance(response, str):
-                # It's a string response
-                content_length = len(response)
-                status_code = 200  # Flask defaults to 200 for string responses
-            
-            # Log the access
-            log_entry = {
-                'timestamp': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'ip': client_ip,
-                'username': username,
-                'method': request.method,
-                'endpoint': request.endpoint,
-                'path': request.path,
-                'status': status_code,
-                'response_size': content_length,
-                'duration': f"{duration:.3f}s",
-                'user_agent': user_agent[:100],  # Limit length
-                'query_params': request.args.to_dict()
-            }
-            
-            # Write to log file
-            log_dir = 'logs'
-            os.makedirs(log_dir, exist_ok=True)
-            
-            with open(os.path.join(log_dir, 'route_access.log'), 'a', encoding='utf-8') as log_file:
-                log_file.write(json.dumps(log_entry) + '\n')
-            
-            return response
-            
-        except Exception as e:
-            # Log the error
-            duration = time.time() - start_time
-            log_entry = {
-                'timestamp': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'ip': client_ip,
-                'username': username,
-                'method': request.method,
-                'endpoint': request.endpoint,
-                'path': request.path,
-                'status': 500,
-                'response_size': 0,
-                'duration': f"{duration:.3f}s",
-                'user_agent': user_agent[:100],
-                'query_params': request.args.to_dict(),
-                'error': str(e)
-            }
-            
-            log_dir = 'logs'
-            os.makedirs(log_dir, exist_ok=True)
-            
-            with open(os.path.join(log_dir, 'route_access.log'), 'a', encoding='utf-8') as log_file:
-                log_file.write(json.dumps(log_entry) + '\n')
-            
-            # Re-raise the exception so Flask can handle it
-            raise
-    
-    return decorated_function
+    return original_func
     
 
 class SecurityLogger:
-    def __init__(self):
+    def __init__(self, queue_handler):
         self.logger = logging.getLogger('security_logger')
         self.logger.setLevel(logging.WARNING)
         
-        log_dir = 'logs'
-        os.makedirs(log_dir, exist_ok=True)
-        
-        fh = logging.FileHandler(os.path.join(log_dir, 'security.log'))
-        formatter = logging.Formatter(
-            '%(asctime)s | SECURITY | %(levelname)s | %(message)s'
-        )
-        fh.setFormatter(formatter)
-        self.logger.addHandler(fh)
+        # Written to the structured log with stream 'security'
+        self.logger.addHandler(queue_handler)
+        self.logger.propagate = False
+    
+    def _log(self, level, event, **fields):
+        if self.logger.isEnabledFor(level):
+            fields['timestamp'] = now_iso()
+            fields['event'] = event
+            self.logger.log(level, '', extra={'data': fields})
     
     def log_failed_login(self, username, ip_address):
-        self.logger.warning(
-            f"Failed login attempt | Username: {username} | IP: {ip_address}"
-        )
+        self._log(logging.WARNING, 'failed_login', username=username, ip=ip_address)
     
     def log_successful_login(self, username, ip_address):
-        self.logger.info(
-            f"Successful login | Username: {username} | IP: {ip_address}"
-        )
+        self._log(logging.INFO, 'successful_login', username=username, ip=ip_address)
     
     def log_logout(self, username, ip_address):
-        self.logger.info(
-            f"User logout | Username: {username} | IP: {ip_address}"
-        )
+        self._log(logging.INFO, 'logout', username=username, ip=ip_address)
     
     def log_unauthorized_access(self, username, ip_address, endpoint):
-        self.logger.warning(
-            f"Unauthorized access attempt | User: {username} | IP: {ip_address} | Endpoint: {endpoint}"
-        )
+        self._log(logging.WARNING, 'unauthorized_access', username=username, ip=ip_address, endpoint=endpoint)
 
 # Initialize loggers (will be fully initialized after sessions and AUTH_CONFIG are defined)
 
@@ -245,7 +259,7 @@ security_logger = None
 def initialize_loggers():
     global request_logger, security_logger
     request_logger = RequestLogger(app)
-    security_logger = SecurityLogger()
+    security_logger = SecurityLogger(request_logger.queue_handler)
 
 
 
@@ -253,15 +267,16 @@ def initialize_loggers():
 class ReverseProxied:
     def __init__(self, app, script_name=None):
         self.app = app
-        self.script_name = script_name
+        # Resolved once, the process environment doesn't change per request
+        self.script_name = script_name or os.environ.get('SCRIPT_NAME', '')
+        self.script_name_len = len(self.script_name)
 
     def __call__(self, environ, start_response):
-        script_name = self.script_name or os.environ.get('SCRIPT_NAME', '')
-        if script_name:
-            environ['SCRIPT_NAME'] = script_name
+        if self.script_name_len:
+            environ['SCRIPT_NAME'] = self.script_name
             path_info = environ['PATH_INFO']
-            if path_info.startswith(script_name):
-                environ['PATH_INFO'] = path_info[len(script_name):]
+            if path_info.startswith(self.script_name):
+                environ['PATH_INFO'] = path_info[self.script_name_len:]
         return self.app(environ, start_response)
 
 app.wsgi_app = ReverseProxied(app.wsgi_app, script_name='/surveillance')
@@ -273,19 +288,25 @@ AUTH_CONFIG = {
     'enabled': True,  # Set to False to disable authentication
     'users': {
         'admin': {
-            # Password: 'same as switch' - will be hashed on first run
+            # Password: from INIT_ADMIN_PASSWORD - will be hashed on first run
             'password_hash': None,  # Will be set automatically
             'role': 'admin'
         },
         'user': {
-            # Password: 'pw' - will be hashed on first run  
+            # Password: from INIT_USER_PASSWORD - will be hashed on first run
             'password_hash': None,  # Will be set automatically
             'role': 'user'
         }
     },
-    'session_timeout': 3600  # 1 hour in seconds
+    'session_timeout': 3600,  # 1 hour in seconds
+    'target_hash_ms': 100,  # bcrypt cost is calibrated at startup to stay under this
+    'bcrypt_cost': 10  # Minimum cost, raised by calibrate_bcrypt_cost()
 }
 
+# Authentication mode isn't reconfigured at runtime, so read it once
+AUTH_ENABLED = bool(AUTH_CONFIG['enabled'])
+SESSION_TIMEOUT = AUTH_CONFIG['session_timeout']
+
 
 # Configuration
 CONFIG = {
@@ -299,14 +320,34 @@ CONFIG = {
             'output_directory': '/home/art3m1sf0wl/program/street_cars/motion_clips'
         }
         # Add more streams here as needed
-    }
+    },
+    # When set, /serve-clip only checks auth and lets nginx send the file via X-Accel-Redirect.
+    # Needs a matching internal location, e.g.:
+    #   location /protected-clips/ { internal; alias /home/art3m1sf0wl/program/street_cars/motion_clips/; }
+    'clip_xaccel_prefix': None  # e.g. '/protected-clips/'
 }
 
 # Global variables for stream management
 stream_managers: Dict[str, 'StreamManager'] = {}
 
+# Bumped and notified whenever a stream's client count or motion state changes,
+# /api/streams/events waits on it instead of the browser polling
+status_changed = threading.Condition()
+status_version = 0
+
+def notify_status_change():
+    global status_version
+    with status_changed:
+        status_version += 1
+        status_changed.notify_all()
+
 # Simple session storage (in production, use Redis or database)
-sessions = {}
+# Entries expire session_timeout seconds after login. TTLCache isn't thread-safe and even a
+# lookup reorders it, so every access, reads included, takes sessions_lock
+sessions = cachetools.TTLCache(maxsize=10_000, ttl=SESSION_TIMEOUT)
+sessions_lock = threading.RLock()
+SESSION_SWEEP_INTERVAL = 256  # get_session calls between bulk expiry sweeps
+_session_reads = 0
 
 # HTML template for login page
 LOGIN_TEMPLATE = '''
@@ -667,6 +708,9 @@ HTML_TEMPLATE = '''
             initializeStream('{{ stream_id }}', 'mjpg');
             {% endfor %}
             
+            // Client count and motion status are pushed by the server
+            startStatusEvents();
+            
             // Load YouTube links when page loads
             loadYouTubeLinks();
         }
@@ -696,9 +740,6 @@ HTML_TEMPLATE = '''
             
             // Store current stream type
             streamTypes[streamId] = streamType;
-            
-            // Start status updates
-            startStatusUpdates(streamId);
         }
         
         function switchStream(streamId, newStreamType) {
@@ -724,62 +765,77 @@ HTML_TEMPLATE = '''
             status.innerHTML = '<span class="online">●</span> Reconnecting...';
         }
         
-        function startStatusUpdates(streamId) {
-            // Update client count and motion status periodically
-            const updateInterval = setInterval(() => {
-                const img = document.getElementById('video-' + streamId);
-                const status = document.getElementById('status-' + streamId);
-                const clients = document.getElementById('clients-' + streamId);
-                const motion = document.getElementById('motion-' + streamId);
-                
-                // Only update if image is still on the page
-                if (!img) {
-                    clearInterval(updateInterval);
-                    return;
+        function showStreamStatus(streamId, data) {
+            const clients = document.getElementById('clients-' + streamId);
+            const motion = document.getElementById('motion-' + streamId);
+            if (clients) {
+                clients.textContent = 'Clients: ' + data.client_count;
+            }
+            // Update motion status if motion detection is enabled
+            if (motion) {
+                motion.textContent = 'Motion: ' + (data.motion_detected ? 'DETECTED' : 'No detection');
+                motion.style.color = data.motion_detected ? '#ff4444' : '#ff9800';
+            }
+        }
+        
+        function startStatusEvents() {
+            // Fall back to polling on browsers without Server-Sent Events
+            if (!window.EventSource) {
+                startStatusPolling();
+                return;
+            }
+            // One connection for all streams, a message is sent only when something changes
+            // (EventSource reconnects by itself if the connection drops)
+            const events = new EventSource(basePath + '/api/streams/events');
+            events.onmessage = function(event) {
+                const streams = JSON.parse(event.data);
+                Object.keys(streams).forEach(streamId => showStreamStatus(streamId, streams[streamId]));
+            };
+        }
+        
+        // One shared timer for all periodic work; each subscriber runs every N ticks
+        const TICK_MS = 3000;
+        const subscribers = [];
+        let tickCount = 0;
+        function subscribe(everyTicks, fn) {
+            subscribers.push({everyTicks: everyTicks, fn: fn});
+        }
+        const scheduler = setInterval(() => {
+            tickCount++;
+            subscribers.forEach(s => {
+                if (tickCount % s.everyTicks === 0) {
+                    s.fn();
                 }
-                
-                // Update client count
-                fetch(basePath + '/api/streams/' + streamId + '/clients')
+            });
+        }, TICK_MS);
+        
+        function startStatusPolling() {
+            // Client count and motion status of every stream in a single request
+            subscribe(1, () => {
+                fetch(basePath + '/api/streams/status')
                     .then(response => {
                         if (!response.ok) {
                             throw new Error('Network response was not ok');
                         }
                         return response.json();
                     })
-                    .then(data => {
-                        if (clients) {
-                            clients.textContent = 'Clients: ' + data.client_count;
-                        }
+                    .then(streams => {
+                        Object.keys(streams).forEach(streamId => showStreamStatus(streamId, streams[streamId]));
                     })
                     .catch(error => {
-                        console.error('Error fetching client count:', error);
-                        if (clients) {
-                            clients.textContent = 'Clients: Error';
-                        }
-                    });
-                
-                // Update motion status if motion detection is enabled
-                if (motion) {
-                    fetch(basePath + '/api/streams/' + streamId + '/motion')
-                        .then(response => {
-                            if (!response.ok) {
-                                throw new Error('Network response was not ok');
+                        console.error('Error fetching stream status:', error);
+                        Object.keys(streamTypes).forEach(streamId => {
+                            const clients = document.getElementById('clients-' + streamId);
+                            const motion = document.getElementById('motion-' + streamId);
+                            if (clients) {
+                                clients.textContent = 'Clients: Error';
+                            }
+                            if (motion) {
+                                motion.textContent = 'Motion: Unknown';
                             }
-                            return response.json();
-                        })
-                        .then(data => {
-                            motion.textContent = 'Motion: ' + (data.motion_detected ? 'DETECTED' : 'No detection');
-                            motion.style.color = data.motion_detected ? '#ff4444' : '#ff9800';
-                        })
-                        .catch(error => {
-                            console.error('Error fetching motion status:', error);
-                            motion.textContent = 'Motion: Unknown';
                         });
-                }
-            }, 3000); // Update every 3 seconds
-            
-            // Store the interval ID so we can clear it if needed
-            img.dataset.updateInterval = updateInterval;
+                    });
+            });
         }
         
         // YouTube Links Functions
@@ -828,16 +884,11 @@ HTML_TEMPLATE = '''
         }
         
         // Auto-refresh YouTube links every 30 seconds
-        setInterval(loadYouTubeLinks, 30000);
+        subscribe(30000 / TICK_MS, loadYouTubeLinks);
         
-        // Clean up intervals when page is unloaded
+        // Clean up the timer when page is unloaded
         window.addEventListener('beforeunload', function() {
-            {% for stream_id in config.streams.keys() %}
-            const img = document.getElementById('video-{{ stream_id }}');
-            if (img && img.dataset.updateInterval) {
-                clearInterval(parseInt(img.dataset.updateInterval));
-            }
-            {% endfor %}
+            clearInterval(scheduler);
         });
         
         // Start streams when page loads
@@ -1046,82 +1097,263 @@ MOTION_CLIPS_TEMPLATE = '''
 </html>
 '''
 
+CHANGE_PASSWORD_TEMPLATE = '''
+    <h1>Change Password</h1>
+    <form method="POST">
+        <div>Current Password: <input type="password" name="current_password" required></div>
+        <div>New Password: <input type="password" name="new_password" required></div>
+        <div>Confirm Password: <input type="password" name="confirm_password" required></div>
+        {% if error %}
+        <div style="color: red;">{{ error }}</div>
+        {% endif %}
+        <button type="submit">Change Password</button>
+    </form>
+    <a href="/">Back to Streams</a>
+'''
 
 
+
+# Stylesheets pulled out of the page templates: name -> (css bytes, gzipped css bytes).
+# The name carries a content hash, so browsers can cache them as immutable
+STATIC_CSS = {}
+
+def externalize_css(name, template):
+    """Move a template's <style> block into STATIC_CSS and link to it instead"""
+    match = re.search(r'<style>(.*?)</style>', template, re.S)
+    if not match:
+        return template
+    css = match.group(1).encode('utf-8')
+    css_name = f"{name}-{hashlib.sha1(css).hexdigest()[:12]}"
+    STATIC_CSS[css_name] = (css, gzip.compress(css, compresslevel=9))
+    link = f'<link rel="stylesheet" href="/surveillance/static-css/{css_name}.css">'
+    return template[:match.start()] + link + template[match.end():]
+
+# Templates are parsed and compiled once; the bytecode cache also skips compilation across restarts.
+# autoescape=True matches what render_template_string does for string templates
+TEMPLATE_ENV = Environment(
+    loader=DictLoader({
+        'login.html': externalize_css('login', LOGIN_TEMPLATE),
+        'index.html': externalize_css('index', HTML_TEMPLATE),
+        'motion_clips.html': externalize_css('motion-clips', MOTION_CLIPS_TEMPLATE),
+        'change_password.html': CHANGE_PASSWORD_TEMPLATE,
+    }),
+    autoescape=True,
+    auto_reload=False,
+    bytecode_cache=FileSystemBytecodeCache()
+)
+LOGIN_TEMPLATE_COMPILED = TEMPLATE_ENV.get_template('login.html')
+HTML_TEMPLATE_COMPILED = TEMPLATE_ENV.get_template('index.html')
+MOTION_CLIPS_TEMPLATE_COMPILED = TEMPLATE_ENV.get_template('motion_clips.html')
+CHANGE_PASSWORD_TEMPLATE_COMPILED = TEMPLATE_ENV.get_template('change_password.html')
+
+def html_response(body, br_body, etag=None):
+    """Response for a pre-rendered page, sent brotli-compressed when the client accepts it"""
+    use_br = 'br' in request.accept_encodings
+    if etag is not None and use_br:
+        etag += '-br'  # Different bytes, different strong ETag
+    if etag is not None and request.if_none_match.contains(etag):
+        # Unchanged page: let the browser reuse its copy
+        response = Response(status=304)
+    else:
+        response = Response(br_body if use_br else body, mimetype='text/html')
+        if use_br:
+            response.headers['Content-Encoding'] = 'br'
+    if etag is not None:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+@app.route('/static-css/<name>.css')
+def static_css(name):
+    """Serve an externalized template stylesheet, gzipped when the client accepts it"""
+    entry = STATIC_CSS.get(name)
+    if entry is None:
+        return "Not found", 404
+    css, css_gz = entry
+    if 'gzip' in request.accept_encodings:
+        response = Response(css_gz, mimetype='text/css')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(css, mimetype='text/css')
+    response.headers['Cache-Control'] = 'public, max-age=86400, immutable'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+# Login form without an error message for the default next_url, as (utf-8 body, brotli body).
+# Built once at the highest quality; any other next_url comes from the (unauthenticated)
+# query string, so those pages are rendered per request and compressed at a cheap level
+_login_page_default = None
+_login_page_lock = threading.Lock()
+LOGIN_PAGE_BROTLI_QUALITY = 4
+
+def _render_login_bytes(next_url, quality):
+    """Render the login form for next_url as (utf-8 body, brotli body)"""
+    body = LOGIN_TEMPLATE_COMPILED.render(
+        error=None,
+        auth_enabled=AUTH_ENABLED,
+        next_url=next_url).encode('utf-8')
+    return body, brotli.compress(body, quality=quality)
+
+def render_login_page(next_url):
+    """Return the login form bytes for next_url, reusing the prebuilt page for the default one"""
+    global _login_page_default
+    default_next = url_for('index')
+    if next_url != default_next:
+        return _render_login_bytes(next_url, LOGIN_PAGE_BROTLI_QUALITY)
+    with _login_page_lock:
+        if _login_page_default is None:
+            _login_page_default = _render_login_bytes(default_next, 11)
+        return _login_page_default
+
 # Authentication functions
 
+# Worker processes for bcrypt, one per core, created in __main__; until then bcrypt runs inline.
+# They come from a forkserver rather than a fork of this threaded process, and import this
+# module as __mp_main__, which skips the startup that must run once in the server
+BCRYPT_POOL = None
+
+def run_bcrypt(func, *args):
+    """Run a bcrypt call in the process pool, or inline if there is none"""
+    if BCRYPT_POOL is None:
+        return func(*args)
+    return BCRYPT_POOL.submit(func, *args).result()
+
+def calibrate_bcrypt_cost():
+    """Pick the highest bcrypt cost (10 or more) that hashes within target_hash_ms"""
+    cost = 10
+    while cost < 16:
+        start = time.perf_counter()
+        bcrypt.hashpw(b'x', bcrypt.gensalt(cost + 1))
+        if (time.perf_counter() - start) * 1000 > AUTH_CONFIG['target_hash_ms']:
+            break
+        cost += 1
+    AUTH_CONFIG['bcrypt_cost'] = cost
+    global _DUMMY_HASH
+    _DUMMY_HASH = bcrypt.hashpw(b'dummy', bcrypt.gensalt(cost))
+    logger.info(f"bcrypt cost calibrated to {cost}")
+
 def initialize_passwords():
     """Hash and store passwords on first run"""
+    # Initial passwords come from INIT_<USER>_PASSWORD, e.g. INIT_ADMIN_PASSWORD
     default_passwords = {
-        'admin': '',
-        'user': ''
+        username: os.environ.get(f'INIT_{username.upper()}_PASSWORD', '')
+        for username in AUTH_CONFIG['users']
     }
     
+    # Hash all missing passwords in parallel, once at startup
+    missing = []
     for username, user_config in AUTH_CONFIG['users'].items():
-        if user_config['password_hash'] is None:
-            password = default_passwords[username]
-            password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-            user_config['password_hash'] = password_hash
-            logger.info(f"Initialized password for user: {username}")
+        if user_config['password_hash'] is not None:
+            continue
+        if not default_passwords[username]:
+            # An empty password would be a valid login; leave the hash unset so logins fail
+            logger.warning(f"No initial password for user {username} (set INIT_{username.upper()}_PASSWORD); login disabled")
+            continue
+        missing.append(username)
+    passwords = [default_passwords[username].encode('utf-8') for username in missing]
+    salts = [bcrypt.gensalt(AUTH_CONFIG['bcrypt_cost']) for _ in missing]
+    if BCRYPT_POOL is None:
+        hashes = map(bcrypt.hashpw, passwords, salts)
+    else:
+        hashes = BCRYPT_POOL.map(bcrypt.hashpw, passwords, salts)
+    for username, password_hash in zip(missing, hashes):
+        AUTH_CONFIG['users'][username]['password_hash'] = password_hash
+        logger.info(f"Initialized password for user: {username}")
             
 def hash_password(password):
-    """Hash a password using bcrypt"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    """Hash a password (bytes) using bcrypt at the calibrated cost"""
+    # The salt carries the cost, so generate it here where AUTH_CONFIG is current
+    return run_bcrypt(bcrypt.hashpw, password, bcrypt.gensalt(AUTH_CONFIG['bcrypt_cost']))
+
+# Recent successful verifications: username -> (HMAC-SHA256 of the password, expiry).
+# The key is per process, so digests are useless outside this process
+VERIFY_CACHE_TTL = 60
+_verify_pepper = os.urandom(32)
+_verify_cache = {}
+
+# Checked against when there is no real hash, so unknown users cost as much as known ones
+_DUMMY_HASH = bcrypt.hashpw(b'dummy', bcrypt.gensalt(AUTH_CONFIG['bcrypt_cost']))
 
 def verify_password(username, password):
-    """Verify username and password using bcrypt"""
-    if not AUTH_CONFIG['enabled']:
+    """Verify username and password (bytes, encoded once by the route) using bcrypt"""
+    if not AUTH_ENABLED:
         return True
     
-    if username in AUTH_CONFIG['users']:
-        stored_hash = AUTH_CONFIG['users'][username]['password_hash']
-        if stored_hash:  # Only verify if password is set
-            # bcrypt.checkpw expects bytes
-            if isinstance(stored_hash, str):
-                stored_hash = stored_hash.encode('utf-8')
-            return bcrypt.checkpw(password.encode('utf-8'), stored_hash)
+    user = AUTH_CONFIG['users'].get(username)
+    stored_hash = user['password_hash'] if user else None
+    if not stored_hash:
+        # Unknown user or no password set: do the same bcrypt work anyway so the
+        # response time doesn't reveal which usernames exist
+        run_bcrypt(bcrypt.checkpw, password, _DUMMY_HASH)
+        return False
+    
+    # Repeat logins within the TTL are checked with one HMAC instead of bcrypt
+    digest = hmac.new(_verify_pepper, password, 'sha256').digest()
+    cached = _verify_cache.get(username)
+    if cached and time.time() < cached[1] and hmac.compare_digest(digest, cached[0]):
+        return True
+    
+    # bcrypt.checkpw expects bytes
+    if isinstance(stored_hash, str):
+        stored_hash = stored_hash.encode('utf-8')
+    if run_bcrypt(bcrypt.checkpw, password, stored_hash):
+        # Upgrade hashes made with a lower cost while we have the plaintext
+        if int(stored_hash[4:6]) < AUTH_CONFIG['bcrypt_cost']:
+            AUTH_CONFIG['users'][username]['password_hash'] = hash_password(password)
+            logger.info(f"Rehashed password for user: {username}")
+        _verify_cache[username] = (digest, time.time() + VERIFY_CACHE_TTL)
+        return True
     
     return False
 
 def change_password(username, new_password):
     """Change a user's password"""
     if username in AUTH_CONFIG['users']:
-        password_hash = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
+        password_hash = hash_password(new_password)
         AUTH_CONFIG['users'][username]['password_hash'] = password_hash
+        # The old password must not keep verifying from the cache
+        _verify_cache.pop(username, None)
         logger.info(f"Password changed for user: {username}")
         return True
     return False
     
+def session_key(session_id):
+    """Index key for a session cookie: a fixed-size SHA-256 prefix, so the raw token is never stored"""
+    return hashlib.sha256(session_id.encode('utf-8')).digest()[:16]
+
 def create_session(username):
     """Create a new session for the user"""
     session_id = secrets.token_urlsafe(32)
-    sessions[session_id] = {
-        'username': username,
-        'role': AUTH_CONFIG['users'][username]['role'],
-        'created_at': time.time()
-    }
+    with sessions_lock:
+        sessions[session_key(session_id)] = {
+            'username': username,
+            'role': AUTH_CONFIG['users'][username]['role'],
+            'created_at': time.time()
+        }
     return session_id
 
 def get_session(session_id):
-    """Get session data and validate timeout"""
-    if session_id in sessions:
-        session = sessions[session_id]
-        if time.time() - session['created_at'] < AUTH_CONFIG['session_timeout']:
-            return session
-        else:
-            # Session expired
-            del sessions[session_id]
-    return None
+    """Get session data (expired sessions are dropped by the TTL cache)"""
+    global _session_reads
+    key = session_key(session_id)
+    with sessions_lock:
+        # The cache only sweeps when a session is created, so also sweep every N reads
+        # to release sessions of users who never came back
+        _session_reads += 1
+        if _session_reads % SESSION_SWEEP_INTERVAL == 0:
+            sessions.expire()
+        return sessions.get(key)
 
 def login_required(f):
     """Decorator to require authentication for routes"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if not AUTH_CONFIG['enabled']:
+        if not AUTH_ENABLED:
             return f(*args, **kwargs)
         
-        session_id = request.cookies.get('session_id')
-        session = get_session(session_id) if session_id else None
+        # Looked up once per request in before_request
+        session = g.session
         
         if not session:
             # Redirect to login page with next parameter
@@ -1138,23 +1370,21 @@ def login_required(f):
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     """Login page"""
-    if not AUTH_CONFIG['enabled']:
+    if not AUTH_ENABLED:
         return redirect(url_for('index'))
     
-    # Get client IP for logging
-    client_ip = request.headers.get('X-Forwarded-For', request.remote_addr)
-    if ',' in client_ip:
-        client_ip = client_ip.split(',')[0].strip()
+    # Client IP for logging, parsed once in before_request
+    client_ip = g.client_ip
         
     if request.method == 'POST':
         username = request.form.get('username')
-        password = request.form.get('password')
+        password = request.form.get('password', '').encode('utf-8')
         next_url = request.form.get('next', url_for('index'))
         
         if verify_password(username, password):
             session_id = create_session(username)
             response = redirect(next_url)
-            response.set_cookie('session_id', session_id, httponly=True, max_age=AUTH_CONFIG['session_timeout'])
+            response.set_cookie('session_id', session_id, httponly=True, max_age=SESSION_TIMEOUT)
             logger.info(f"User {username} logged in successfully")
             # Log successful login
             security_logger.log_successful_login(username, client_ip)
@@ -1167,31 +1397,29 @@ def login():
             security_logger.log_failed_login(username, client_ip)
             logger.warning(f"Failed login attempt for username: {username} from {client_ip}")
             
-            return render_template_string(LOGIN_TEMPLATE, 
+            return LOGIN_TEMPLATE_COMPILED.render(
                                        error="Invalid username or password",
-                                       auth_enabled=AUTH_CONFIG['enabled'],
+                                       auth_enabled=AUTH_ENABLED,
                                        next_url=next_url)
     
     # GET request - show login form
     next_url = request.args.get('next', url_for('index'))
-    return render_template_string(LOGIN_TEMPLATE, 
-                               error=None,
-                               auth_enabled=AUTH_CONFIG['enabled'],
-                               next_url=next_url)
+    return html_response(*render_login_page(next_url))
 
 @app.route('/logout')
 def logout():
     """Logout user"""
     
-    # Get client IP for logging
-    client_ip = request.headers.get('X-Forwarded-For', request.remote_addr)
-    if ',' in client_ip:
-        client_ip = client_ip.split(',')[0].strip()
+    # Client IP for logging, parsed once in before_request
+    client_ip = g.client_ip
     
     session_id = request.cookies.get('session_id')
-    if session_id in sessions:
-        username = sessions[session_id]['username']
-        del sessions[session_id]
+    session = None
+    if session_id:
+        with sessions_lock:
+            session = sessions.pop(session_key(session_id), None)
+    if session:
+        username = session['username']
         # Log logout
         security_logger.log_logout(username, client_ip)
         logger.info(f"User {username} logged out from {client_ip}")
@@ -1207,39 +1435,20 @@ def logout():
 def change_password_route():
     """Allow users to change their password"""
     if request.method == 'POST':
-        current_password = request.form.get('current_password')
-        new_password = request.form.get('new_password')
-        confirm_password = request.form.get('confirm_password')
+        # The auth helpers take bytes; encode each field once here
+        current_password = request.form.get('current_password', '').encode('utf-8')
+        new_password = request.form.get('new_password', '').encode('utf-8')
+        confirm_password = request.form.get('confirm_password', '').encode('utf-8')
         
         username = request.user['username']
         
         # Verify current password
         if not verify_password(username, current_password):
-            return render_template_string('''
-                <h1>Change Password</h1>
-                <form method="POST">
-                    <div>Current Password: <input type="password" name="current_password" required></div>
-                    <div>New Password: <input type="password" name="new_password" required></div>
-                    <div>Confirm Password: <input type="password" name="confirm_password" required></div>
-                    <div style="color: red;">Current password is incorrect</div>
-                    <button type="submit">Change Password</button>
-                </form>
-                <a href="/">Back to Streams</a>
-            ''')
+            return CHANGE_PASSWORD_TEMPLATE_COMPILED.render(error='Current password is incorrect')
         
         # Check if new passwords match
         if new_password != confirm_password:
-            return render_template_string('''
-                <h1>Change Password</h1>
-                <form method="POST">
-                    <div>Current Password: <input type="password" name="current_password" required></div>
-                    <div>New Password: <input type="password" name="new_password" required></div>
-                    <div>Confirm Password: <input type="password" name="confirm_password" required></div>
-                    <div style="color: red;">New passwords do not match</div>
-                    <button type="submit">Change Password</button>
-                </form>
-                <a href="/">Back to Streams</a>
-            ''')
+            return CHANGE_PASSWORD_TEMPLATE_COMPILED.render(error='New passwords do not match')
         
         # Change the password
         if change_password(username, new_password):
@@ -1256,18 +1465,17 @@ def change_password_route():
             '''
     
     # GET request - show change password form
-    return render_template_string('''
-        <h1>Change Password</h1>
-        <form method="POST">
-            <div>Current Password: <input type="password" name="current_password" required></div>
-            <div>New Password: <input type="password" name="new_password" required></div>
-            <div>Confirm Password: <input type="password" name="confirm_password" required></div>
-            <button type="submit">Change Password</button>
-        </form>
-        <a href="/">Back to Streams</a>
-    ''')
+    return CHANGE_PASSWORD_TEMPLATE_COMPILED.render(error=None)
     
   
+# Clip listing as (directory mtime, files), rebuilt only when the mtime changes (checked at
+# most every MOTION_CLIPS_CACHE_TTL seconds). Clips are encoded under a .part name and renamed
+# into place, so a finished clip always changes the mtime. 'html' holds (mtime, page) per
+# username; a page built from an older listing is re-rendered
+MOTION_CLIPS_CACHE_TTL = 5
+VIDEO_EXTS = ('.mp4', '.avi', '.mov', '.mkv')
+_clips_cache = {'checked': 0, 'listing': (None, []), 'html': {}}
+
 @app.route('/motion-clips')
 @login_required
 #@log_access
@@ -1277,27 +1485,49 @@ def motion_clips():
         # Get the output directory from the first stream config
         output_dir = list(CONFIG['streams'].values())[0]['output_directory']
         
-        # Get list of files in the directory
-        files = []
-        if os.path.exists(output_dir):
-            for filename in sorted(os.listdir(output_dir), reverse=True):
-                filepath = os.path.join(output_dir, filename)
-                if os.path.isfile(filepath) and filename.lower().endswith(('.mp4', '.avi', '.mov', '.mkv')):
-                    stat = os.stat(filepath)
-                    files.append({
-                        'name': filename,
-                        'size': stat.st_size,
-                        'modified': datetime.datetime.fromtimestamp(stat.st_mtime),
-                        'path': filepath
-                    })
-        
-        return render_template_string(MOTION_CLIPS_TEMPLATE, 
-                                   files=files, 
-                                   username=request.user['username'])
+        now = time.time()
+        if now - _clips_cache['checked'] >= MOTION_CLIPS_CACHE_TTL:
+            _clips_cache['checked'] = now
+            try:
+                mtime = os.stat(output_dir).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime != _clips_cache['listing'][0]:
+                # Swapped in as one tuple, so readers never pair a new mtime with old files
+                _clips_cache['listing'] = (mtime, list_motion_clips(output_dir))
+        
+        mtime, files = _clips_cache['listing']
+        username = request.user['username']
+        cached = _clips_cache['html'].get(username)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        # The template checks request.user.role; Flask's context isn't injected here
+        html = MOTION_CLIPS_TEMPLATE_COMPILED.render(files=files, 
+                                                     username=username,
+                                                     request=request)
+        _clips_cache['html'][username] = (mtime, html)
+        return html
     except Exception as e:
         logger.error(f"Error loading motion clips: {e}")
         return "Error loading motion clips", 500
 
+def list_motion_clips(output_dir):
+    """Return the video files in output_dir, newest name first"""
+    # scandir gets names and file types in one pass, and each entry's stat() is cached
+    files = []
+    if os.path.exists(output_dir):
+        with os.scandir(output_dir) as it:
+            entries = [e for e in it if e.is_file(follow_symlinks=False) and e.name.lower().endswith(VIDEO_EXTS)]
+        for entry in sorted(entries, key=lambda e: e.name, reverse=True):
+            stat = entry.stat()
+            files.append({
+                'name': entry.name,
+                'size': stat.st_size,
+                'modified': datetime.datetime.fromtimestamp(stat.st_mtime),
+                'path': entry.path
+            })
+    return files
+
 @app.route('/serve-clip/<path:filename>')
 @login_required
 #@log_access
@@ -1324,13 +1554,17 @@ def serve_clip(filename):
         elif filename.lower().endswith('.mkv'):
             mime_type = 'video/x-matroska'
             
-        return Response(
-            open(filepath, 'rb').read(),
-            mimetype=mime_type,
-            headers={
-                'Content-Disposition': f'inline; filename="{filename}"'
-            }
-        )
+        # Behind nginx, hand the transfer to the proxy; the worker returns an empty response at once
+        xaccel_prefix = CONFIG.get('clip_xaccel_prefix')
+        if xaccel_prefix:
+            return Response('', mimetype=mime_type, headers={
+                'X-Accel-Redirect': xaccel_prefix + quote(filename),
+                'Content-Disposition': f'inline; filename="{os.path.basename(filename)}"'
+            })
+        
+        # Streams from disk (sendfile where the server supports it) and answers Range requests for seeking
+        return send_file(filepath, mimetype=mime_type, as_attachment=False,
+                         download_name=os.path.basename(filename), conditional=True)
     except Exception as e:
         logger.error(f"Error serving clip {filename}: {e}")
         return "Error serving file", 500
@@ -1362,6 +1596,7 @@ def delete_clip(filename):
             return "File not found", 404
             
         os.remove(filepath)
+        _clips_cache['checked'] = 0  # Pick up the deletion on the next listing
         logger.info(f"Admin {request.user['username']} deleted motion clip: {filename}")
         return "File deleted", 200
         
@@ -1376,40 +1611,86 @@ def delete_clip(filename):
 
 
 # Your existing classes (StreamClient, MotionAnalyzer, StreamManager) remain the same
+class LatestFrameRing:
+    """Recent frames shared by all clients of a stream: one writer, any number of readers"""
+    def __init__(self, size=8):
+        self.size = size
+        self.slots = [(0, None)] * size  # (seq, frame), frame seq lives in slot seq % size
+        self.seq = 0
+        # Readers sleep on it until seq moves past the last frame they took
+        self.cond = threading.Condition()
+        
+    def publish(self, frame):
+        """Store a frame and wake the readers (called by the stream worker only)"""
+        seq = self.seq + 1
+        self.slots[seq % self.size] = (seq, frame)
+        with self.cond:
+            self.seq = seq
+            self.cond.notify_all()
+        
+    def read_after(self, last_seq):
+        """Frames newer than last_seq that are still in the ring, oldest first, with the newest seq"""
+        seq = self.seq
+        first = max(last_seq + 1, seq - self.size + 1)
+        frames = []
+        for s in range(first, seq + 1):
+            slot_seq, frame = self.slots[s % self.size]
+            if slot_seq == s:  # Skip a slot the writer already moved past
+                frames.append(frame)
+        return frames, seq
+
+
 class StreamClient:
     """Represents a client consuming the stream"""
-    def __init__(self):
+    def __init__(self, ring):
         self.connected = True
-        self.buffer = collections.deque(maxlen=100)  # Buffer for recent frames
-        
-    def add_frame(self, frame_data):
-        """Add a frame to client's buffer"""
-        self.buffer.append(frame_data)
+        self.ring = ring
+        self.last_seq = ring.seq  # Start with the next published frame
         
     def get_frames(self):
-        """Generator that yields frames from buffer"""
+        """Generator that yields frames from the shared ring, skipping any it fell behind on"""
+        ring = self.ring
         while self.connected:
-            if self.buffer:
-                yield self.buffer.popleft()
+            frames, self.last_seq = ring.read_after(self.last_seq)
+            if frames:
+                yield from frames  # Outside the lock, a slow client doesn't hold up the others
             else:
-                time.sleep(0.001)  # Small sleep to prevent busy waiting
+                with ring.cond:
+                    if ring.seq == self.last_seq:
+                        ring.cond.wait(1.0)  # Timeout so a disconnect is noticed even if the stream stalls
                 
                 
 class MotionAnalyzer:
     def __init__(self, output_directory="motion_clips", fps=30):
-        # Background subtractor with parameters tuned for heat haze
+        # Background subtractor with parameters tuned for heat haze. history only sets how
+        # fast the (fixed-size) per-pixel sample model adapts: 100 analysed frames at
+        # detect_rate_hz is about as long as the former 400 frames at the camera rate
+        self.bg_history = 100
+        self.bg_learning_rate = 1.0 / self.bg_history
         self.fgbg = cv2.createBackgroundSubtractorKNN(
-            history=400,
+            history=self.bg_history,
             dist2Threshold=1000,
             detectShadows=False
         )
         
         # Motion validation parameters
         self.min_contour_area = 500  # formerly 1500, Minimum contour area to consider
-        self.motion_buffer = collections.deque(maxlen=5)  # Stores recent motion states
+        # Recent motion states as bits, newest in bit 0, over the last motion_window frames
+        self.motion_window = 5
+        self._motion_bits = 0
+        self._motion_count = 0  # How many of the window's bits are filled so far
         self.required_consecutive = 3  # Reduced from 5 to be more responsive
         self.heat_haze_kernel_size = 25
         
+        # Detection runs on a downscaled copy at most detect_width pixels wide; the
+        # area and blur size above are in full-resolution pixels and scaled to match
+        self.detect_width = 640
+        self.detect_scale = None  # Picked from the first frame (see _init_detect_buffers)
+        self._frame_shape = None
+        self._morph_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
+        # Thumbnail pixels (of 160x120) that must change before the full detector runs
+        self.change_gate_pixels = 2
+        
         # Video clip parameters
         self.clip_before = 1.0  # Increased from 0.5 to capture more pre-motion
         self.clip_after = 2.0  # Increased from 1.0 to capture more post-motion
@@ -1430,8 +1711,21 @@ class MotionAnalyzer:
         # Frame processing
         self.frame_counter = 0
         self.process_every_n_frames = 1  # Process every 2nd frame (was 3)
+        # Car-scale motion doesn't need the source rate; clips still get every frame
+        self.detect_rate_hz = 5
+        self.detect_interval = 1.0 / self.detect_rate_hz
+        self._last_detect_t = 0.0
         self.fps = fps
         
+        # Detection runs on its own thread so the capture loop never waits for OpenCV.
+        # _state_lock guards the buffers, the recording state and the latest-frame slot
+        self._detect_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='motion')
+        self._state_lock = threading.Lock()
+        # Frames waiting for the worker, taken as one batch; the oldest are dropped when it falls behind
+        self.detect_batch_size = 4
+        self._pending_frames = collections.deque(maxlen=self.detect_batch_size)
+        self._worker_busy = False
+        
         # Timing control for recording
         self.last_frame_time = None
         self.frame_interval = 1.0 / fps
@@ -1446,23 +1740,65 @@ class MotionAnalyzer:
         cv2.circle(mask, center, self.mask_radius, 255, -1)
         return mask
 
+    def _init_detect_buffers(self, frame_shape):
+        """Pick the detection scale for this frame size and allocate the per-frame scratch arrays"""
+        height, width = frame_shape
+        self._frame_shape = frame_shape
+        self.detect_scale = min(1.0, self.detect_width / width)
+        self._detect_size = (round(width * self.detect_scale), round(height * self.detect_scale))
+        self._detect_min_area = self.min_contour_area * self.detect_scale ** 2
+        self._detect_kernel_size = max(3, int(self.heat_haze_kernel_size * self.detect_scale) | 1)  # Must stay odd
+        
+        small_w, small_h = self._detect_size
+        self._small = np.empty((small_h, small_w, 3), dtype=np.uint8)
+        self._gray = np.empty((small_h, small_w), dtype=np.uint8)
+        self._blur = np.empty((small_h, small_w), dtype=np.uint8)
+        self._fgmask = np.empty((small_h, small_w), dtype=np.uint8)
+        self._thumb = np.empty((120, 160), dtype=np.uint8)
+        self._prev_thumb = None
+        self._thumb_diff = np.empty((120, 160), dtype=np.uint8)
+
     def detect_significant_motion(self, frame):
         """Same as your original motion detection"""
         #if self.circular_mask is None:
             #self.circular_mask = self._create_circular_mask(frame) #uncomment to add the mask
         
-        # Preprocessing to reduce heat haze effects
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        blurred = cv2.GaussianBlur(gray, (self.heat_haze_kernel_size, self.heat_haze_kernel_size), 0)
+        if frame.shape[:2] != self._frame_shape:
+            self._init_detect_buffers(frame.shape[:2])
+        
+        # Fewer pixels means proportionally less work in every step below
+        if self.detect_scale < 1.0:
+            frame = cv2.resize(frame, self._detect_size, dst=self._small, interpolation=cv2.INTER_AREA)
+        
+        # Preprocessing to reduce heat haze effects (written into the preallocated buffers)
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        blurred = cv2.GaussianBlur(gray, (self._detect_kernel_size, self._detect_kernel_size), 0, dst=self._blur)
         #blurred = cv2.bitwise_and(blurred, blurred, mask=self.circular_mask)  # Uncomment if using mask
         
+        # Cheap change gate: if a 160x120 thumbnail barely differs from the last analysed
+        # frame, nothing can have moved enough to matter, so skip the KNN and contour work
+        cv2.resize(blurred, (160, 120), dst=self._thumb, interpolation=cv2.INTER_AREA)
+        if self._prev_thumb is not None:
+            cv2.absdiff(self._thumb, self._prev_thumb, dst=self._thumb_diff)
+            cv2.threshold(self._thumb_diff, 25, 255, cv2.THRESH_BINARY, dst=self._thumb_diff)
+            changed = cv2.countNonZero(self._thumb_diff)
+        else:
+            self._prev_thumb = np.empty_like(self._thumb)
+            changed = None
+        self._thumb, self._prev_thumb = self._prev_thumb, self._thumb
+        if changed is not None and changed < self.change_gate_pixels:
+            return self._update_motion_bits(False)
+        
         # Background subtraction
-        fgmask = self.fgbg.apply(blurred)
+        # Explicit rate so the model adapts per analysed frame, however sparsely they are sampled
+        fgmask = self.fgbg.apply(blurred, self._fgmask, learningRate=self.bg_learning_rate)
         
-        # Morphological operations to reduce noise
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
-        fgmask = cv2.morphologyEx(fgmask, cv2.MORPH_OPEN, kernel)
-        fgmask = cv2.morphologyEx(fgmask, cv2.MORPH_CLOSE, kernel)
+        # Morphological operations to reduce noise: open then close is erode, dilate x2, erode,
+        # done in place on fgmask so no intermediate masks are allocated
+        kernel = self._morph_kernel
+        cv2.erode(fgmask, kernel, dst=fgmask)
+        cv2.dilate(fgmask, kernel, dst=fgmask, iterations=2)
+        cv2.erode(fgmask, kernel, dst=fgmask)
         
         # Find contours
         contours, _ = cv2.findContours(fgmask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -1470,80 +1806,122 @@ class MotionAnalyzer:
         # Check for significant contours
         significant_motion = False
         for contour in contours:
-            if cv2.contourArea(contour) > self.min_contour_area:
+            if cv2.contourArea(contour) > self._detect_min_area:
                 significant_motion = True
                 break
                 
-        # Update motion buffer
-        self.motion_buffer.append(significant_motion)
+        return self._update_motion_bits(significant_motion)
+
+    def _update_motion_bits(self, significant_motion):
+        """Record this frame's motion state and return whether motion is confirmed"""
+        # Update motion bits
+        self._motion_bits = ((self._motion_bits << 1) | significant_motion) & ((1 << self.motion_window) - 1)
+        self._motion_count = min(self._motion_count + 1, self.motion_window)
         
-        # Check for consecutive motion frames
-        if len(self.motion_buffer) >= self.required_consecutive:
-            return all(self.motion_buffer)
+        # Check for consecutive motion frames: every filled bit of the window must be set
+        if self._motion_count >= self.required_consecutive:
+            return self._motion_bits == (1 << self._motion_count) - 1
         return False
 
-    def process_frame(self, frame, frame_bytes):
-        """Process a frame for motion detection with proper timing"""
+    def submit_frame(self, frame, frame_bytes):
+        """Buffer a frame and hand it to the detection worker without waiting for it"""
         current_time = time.time()
         
-        # Store frame with timestamp for accurate timing
+        # Store frame with timestamp for accurate timing. cap.read() hands out a new array
+        # every call and nothing here writes into it, so the buffer can hold the frame as is
         frame_data = {
-            'frame': frame.copy(),
+            'frame': frame,
             'timestamp': current_time
         }
-        self.frame_buffer.append(frame_data)
         
-        # Frame sampling to reduce CPU load
-        self.frame_counter += 1
-        if self.frame_counter % self.process_every_n_frames != 0:
-            return self.motion_detected
-            
-        # Detect motion
-        has_motion = self.detect_significant_motion(frame)
-        
-        if has_motion:
-            if not self.is_recording:
-                # Start new clip - calculate how many pre-motion frames to include
-                self.is_recording = True
-                self.clip_start_time = current_time
-                
-                # Find frames from before motion started
-                pre_motion_frames = []
-                cutoff_time = current_time - self.clip_before
-                
-                for frame_data in list(self.frame_buffer):
-                    if frame_data['timestamp'] >= cutoff_time:
-                        pre_motion_frames.append(frame_data)
-                
-                self.clip_frames = pre_motion_frames
-                logger.info(f"Motion detected at {datetime.datetime.fromtimestamp(current_time)}")
-        
-            # Add current frame to clip
-            self.clip_frames.append(frame_data)
-            self.last_motion_time = current_time
-            self.motion_detected = True
-            self.last_motion_update = current_time
-            
-        else:
+        with self._state_lock:
+            self.frame_buffer.append(frame_data)
+            # Every frame goes into an open clip, even ones detection skips
             if self.is_recording:
-                # Add current frame to clip (continue briefly after motion stops)
                 self.clip_frames.append(frame_data)
             
-                # Check if we should end the clip
-                if (current_time - self.last_motion_time) > self.clip_after:
+            # Frame sampling to reduce CPU load: every n-th frame, at most detect_rate_hz
+            self.frame_counter += 1
+            if self.frame_counter % self.process_every_n_frames != 0:
+                return self.motion_detected
+            now = time.monotonic()
+            if now - self._last_detect_t < self.detect_interval:
+                return self.motion_detected
+            self._last_detect_t = now
+            
+            self._pending_frames.append(frame_data)
+            start_worker = not self._worker_busy
+            self._worker_busy = True
+        
+        if start_worker:
+            self._detect_executor.submit(self._detection_loop)
+        return self.motion_detected
+
+    def _detection_loop(self):
+        """Run detection on batches of pending frames until none are waiting"""
+        while True:
+            # One lock round-trip per batch rather than per frame
+            with self._state_lock:
+                batch = list(self._pending_frames)
+                self._pending_frames.clear()
+                if not batch:
+                    self._worker_busy = False
+                    return
+            try:
+                self.process_batch(batch)
+            except Exception as e:
+                logger.error(f"Motion detection error: {e}")
+
+    def process_batch(self, batch):
+        """Detect motion on a batch of frames, then feed the results to the recording state"""
+        detect = self.detect_significant_motion
+        results = [detect(frame_data['frame']) for frame_data in batch]
+        for frame_data, has_motion in zip(batch, results):
+            self.process_frame(frame_data, has_motion)
+        return results
+
+    def process_frame(self, frame_data, has_motion):
+        """Update the recording state for one analysed frame with proper timing"""
+        current_time = frame_data['timestamp']
+        
+        clip_to_save = None
+        with self._state_lock:
+            if has_motion:
+                if not self.is_recording:
+                    # Start new clip - calculate how many pre-motion frames to include
+                    self.is_recording = True
+                    self.clip_start_time = current_time
+                    
+                    # Frames from before motion started, plus any that arrived while detecting
+                    cutoff_time = current_time - self.clip_before
+                    self.clip_frames = [f for f in self.frame_buffer if f['timestamp'] >= cutoff_time]
+                    logger.info(f"Motion detected at {datetime.datetime.fromtimestamp(current_time)}")
+            
+                self.last_motion_time = current_time
+                self.motion_detected = True
+                self.last_motion_update = current_time
+                
+            else:
+                # Check if we should end the clip (submit_frame keeps adding frames until then)
+                if self.is_recording and (current_time - self.last_motion_time) > self.clip_after:
                     # Save clip if it meets minimum length
                     clip_length = current_time - self.clip_start_time
                     if clip_length >= self.min_clip_length:
-                        self._save_video_clip(self.clip_frames, self.clip_start_time)
-                        logger.info(f"Saved motion clip: {clip_length:.2f} seconds")
+                        clip_to_save = (self.clip_frames, self.clip_start_time, clip_length)
                 
                     # Reset recording state
                     self.is_recording = False
                     self.clip_frames = []
+            
+                # Reset motion detected status after 2 seconds of no motion
+                if current_time - self.last_motion_update > 2.0:
+                    self.motion_detected = False
         
-            # Reset motion detected status after 2 seconds of no motion
-            if current_time - self.last_motion_update > 2.0:
-                self.motion_detected = False
+        # Encode outside the lock so the capture thread keeps buffering meanwhile
+        if clip_to_save:
+            frames, start_time, clip_length = clip_to_save
+            self._save_video_clip(frames, start_time)
+            logger.info(f"Saved motion clip: {clip_length:.2f} seconds")
         
         return has_motion
 
@@ -1570,7 +1948,7 @@ class MotionAnalyzer:
                 last_frame = frames[-1]['frame']  # CHANGED: access 'frame' key
                 for _ in range(needed_frames):
                     frames.append({
-                        'frame': last_frame.copy(),
+                        'frame': last_frame,  # Only read when writing to ffmpeg, no copy needed
                         'timestamp': frames[-1]['timestamp'] + (1.0 / self.fps)
                     })
                 actual_duration = self.min_clip_length
@@ -1586,35 +1964,32 @@ class MotionAnalyzer:
             # Extract just the frame data for writing - FIXED: access 'frame' key
             frame_data = [frame_data['frame'] for frame_data in frames]  # CHANGED THIS LINE
             
-            # Write video using FFmpeg with constant frame rate
-            process = subprocess.Popen([
-                'ffmpeg',
-                '-y',  # Overwrite without asking
-                '-f', 'rawvideo',
-                '-vcodec', 'rawvideo',
-                '-s', f'{width}x{height}',
-                '-pix_fmt', 'bgr24',
-                '-r', str(actual_fps),  # Use constant calculated FPS
-                '-i', '-',
-                '-c:v', 'libx264',
-                '-preset', 'fast',
-                '-crf', '23',
-                '-pix_fmt', 'yuv420p',
-                '-r', str(actual_fps),  # Output FPS (same as input)
-                '-vsync', 'cfr',  # Constant frame rate (changed from vfr)
-                output_path
-            ], stdin=subprocess.PIPE, stderr=subprocess.PIPE)
-            
-            for frame in frame_data:
-                process.stdin.write(frame.tobytes())
-            
-            process.stdin.close()
-            
-            # Wait for process to complete and check for errors
-            _, stderr = process.communicate()
-            
-            if process.returncode != 0:
-                logger.error(f"FFmpeg error: {stderr.decode()}")
+            # Encode in-process with PyAV: frames go to x264 straight from the ndarrays,
+            # with no ffmpeg process to start and no tobytes() copy per frame. Written under a
+            # temporary name so the clip listing never shows a half-written file
+            temp_path = output_path + '.part'
+            container = av.open(temp_path, 'w', format='mp4')
+            try:
+                stream = container.add_stream('libx264', rate=Fraction(actual_fps).limit_denominator(1000))
+                stream.width = width
+                stream.height = height
+                stream.pix_fmt = 'yuv420p'
+                stream.options = {'preset': 'fast', 'crf': '23'}
+                
+                for frame in frame_data:
+                    video_frame = av.VideoFrame.from_ndarray(frame, format='bgr24')
+                    for packet in stream.encode(video_frame):
+                        container.mux(packet)
+                
+                # Flush frames still buffered in the encoder
+                for packet in stream.encode():
+                    container.mux(packet)
+            except Exception:
+                container.close()
+                os.remove(temp_path)
+                raise
+            container.close()
+            os.replace(temp_path, output_path)
             
             # Check if file was created successfully
             if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
@@ -1635,14 +2010,42 @@ class StreamManager:
         self.stream_id = stream_id
         self.host = host
         self.port = port
-        self.clients: Set[StreamClient] = set()
+        # Copy-on-write: add/remove build a new tuple under clients_lock and swap it in,
+        # so the per-frame readers just load the attribute without locking
+        self.clients: Tuple[StreamClient, ...] = ()
         self.clients_lock = threading.Lock()
         self.running = True
         self.cap = None  # Change from socket to OpenCV VideoCapture
         self.thread = None
         self.last_frame = None
+        self.last_part = None  # last_frame as a ready-made MJPEG part
+        self.ring = LatestFrameRing()  # (JPEG, MJPEG part) per frame
+        # JPEG quality for viewers: the first level while everyone keeps up, stepping down
+        # at once when a client lags in the ring or the estimated outgoing rate exceeds the
+        # budget. Stepping back up waits jpeg_quality_hold seconds and needs headroom
+        self.fps = fps
+        self.frame_interval = 1.0 / fps
+        self._next_frame_t = 0.0
+        self.jpeg_quality_levels = (60, 30, 10)
+        self.bandwidth_budget = 2_000_000  # bytes/s across all viewers of this stream
+        self.jpeg_quality_hold = 3.0
+        self.jpeg_reprobe_interval = 30.0  # Retry a level whose estimate didn't fit after this long
+        self.jpeg_quality = self.jpeg_quality_levels[-1]
+        self._jpeg_level = len(self.jpeg_quality_levels) - 1
+        self._jpeg_level_since = 0.0
+        # Average frame size per quality level, each only updated while that level is in use
+        self.jpeg_size_ewma = dict.fromkeys(self.jpeg_quality_levels, 0.0)
+        # One shared fragmented-MP4 encoder for all /mp4_feed clients, started with the first
+        # and stopped with the last. Fragments go out through their own ring
+        self.mp4_lock = threading.Lock()
+        self.mp4_clients = 0
+        self.mp4_process = None
+        self.mp4_feeder = None
+        self.mp4_init = None  # ftyp+moov, sent to every client before its first fragment
+        self.mp4_ring = LatestFrameRing(size=16)
         self.motion_detection = motion_detection
         self.motion_analyzer = None
+        self.last_motion_status = False
         
         if motion_detection:
             self.motion_analyzer = MotionAnalyzer(output_directory, fps=fps)
@@ -1660,7 +2063,7 @@ class StreamManager:
         with self.clients_lock:
             for client in self.clients:
                 client.connected = False
-            self.clients.clear()
+            self.clients = ()
         
         if self.cap:
             try:
@@ -1668,27 +2071,34 @@ class StreamManager:
             except:
                 pass
         
+        with self.mp4_lock:
+            if self.mp4_process is not None:
+                self._stop_mp4_encoder()
+        
         logger.info(f"[{self.stream_id}] Stream manager stopped")
         
     def add_client(self) -> StreamClient:
         """Add a new client to this stream"""
-        client = StreamClient()
+        client = StreamClient(self.ring)
         with self.clients_lock:
-            self.clients.add(client)
-        logger.info(f"[{self.stream_id}] Client added. Total clients: {len(self.clients)}")
+            self.clients = self.clients + (client,)
+        notify_status_change()
+        logger.info(f"[{self.stream_id}] Client added. Total clients: {self.get_client_count()}")
         return client
         
     def remove_client(self, client: StreamClient):
         """Remove a client from this stream"""
         client.connected = False
         with self.clients_lock:
-            self.clients.discard(client)
-        logger.info(f"[{self.stream_id}] Client removed. Total clients: {len(self.clients)}")
+            self.clients = tuple(c for c in self.clients if c is not client)
+        notify_status_change()
+        logger.info(f"[{self.stream_id}] Client removed. Total clients: {self.get_client_count()}")
         
     def get_client_count(self):
         """Get current number of connected clients"""
-        with self.clients_lock:
-            return len(self.clients)
+        # MP4 viewers share one feeder client of the ring: count the viewers instead of it
+        clients = self.clients
+        return len(clients) - (self.mp4_feeder in clients) + self.mp4_clients
     
     def get_motion_status(self):
         """Get current motion detection status"""
@@ -1723,30 +2133,189 @@ class StreamManager:
             logger.warning(f"[{self.stream_id}] Failed to read frame from TCP stream")
             return None, None
         
-        # Convert frame to bytes for streaming to clients
-        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 10])
-        frame_bytes = buffer.tobytes()
+        # The upstream is H264, so clients need a JPEG re-encode; skip it while nobody watches
+        # (frame_bytes is then None and only motion detection sees the frame)
+        if not self.clients:
+            self.last_frame = self.last_part = None  # Don't greet the next client with a stale frame
+            return frame, None
+        
+        # Pace viewer frames on a wall-clock deadline of one per 1/fps. When the decoder
+        # hands over a backlog (e.g. after a stall), frames well ahead of the deadline are
+        # not encoded; the reader keeps draining instead of sleeping, so latency stays low
+        now = time.monotonic()
+        if now < self._next_frame_t - self.frame_interval / 2:
+            return frame, None
+        if now - self._next_frame_t > 0.5:
+            self._next_frame_t = now  # Far behind: restart the schedule rather than burst to catch up
+        self._next_frame_t += self.frame_interval
+        
+        # Convert frame to bytes for streaming to clients. imencode already returns a fresh
+        # array per frame; share it as a read-only view instead of copying it with tobytes()
+        self.jpeg_quality = quality = self._pick_jpeg_quality(now)
+        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        frame_bytes = buffer.data.toreadonly()
+        ewma = self.jpeg_size_ewma[quality]
+        # The first frame at a level seeds its estimate instead of creeping up from 0
+        self.jpeg_size_ewma[quality] = len(frame_bytes) if not ewma else ewma + 0.1 * (len(frame_bytes) - ewma)
         
         return frame, frame_bytes
 
+    def _pick_jpeg_quality(self, now):
+        """Choose the JPEG quality from client backpressure and the outgoing bandwidth estimate"""
+        clients = self.clients  # Immutable snapshot, no lock needed
+        levels = self.jpeg_quality_levels
+        lowest = len(levels) - 1
+        
+        # Backpressure: how many frames the slowest client is behind in the ring
+        seq = self.ring.seq
+        lag = max((seq - client.last_seq for client in clients), default=0)
+        level = min(0 if lag <= 1 else 1 if lag <= 4 else 2, lowest)
+        
+        # Each level's own frame size times fps times viewers, against the budget. The MP4
+        # feeder is a client of the ring but sends nothing to the network itself
+        rate = self.fps * (len(clients) - (self.mp4_feeder in clients))
+        while level < lowest and self.jpeg_size_ewma[levels[level]] * rate > self.bandwidth_budget:
+            level += 1
+        
+        current = self._jpeg_level
+        if level < current:
+            # Step up one level at a time, after a hold, and only if its estimate fits with 20%
+            # to spare. A level that didn't fit is retried after the reprobe interval, measured afresh
+            held = now - self._jpeg_level_since
+            up = current - 1
+            if held < self.jpeg_quality_hold:
+                level = current
+            elif self.jpeg_size_ewma[levels[up]] * rate <= 0.8 * self.bandwidth_budget:
+                level = up
+            elif held >= self.jpeg_reprobe_interval:
+                self.jpeg_size_ewma[levels[up]] = 0.0
+                level = up
+            else:
+                level = current
+        if level != current:
+            self._jpeg_level = level
+            self._jpeg_level_since = now
+        return levels[level]
+
     def _distribute_frame(self, frame_bytes):
         """Distribute frame to all connected clients"""
+        # Build the MJPEG part (headers, JPEG, next boundary) once here instead of once per client
+        part = b''.join((_PART_PREFIX, b'%d' % len(frame_bytes), _PART_MID, frame_bytes, _PART_TAIL))
         self.last_frame = frame_bytes  # Keep last frame for new clients
-        
-        # Distribute to clients
-        with self.clients_lock:
-            clients_to_remove = []
-            
-            for client in self.clients:
-                try:
-                    client.add_frame(frame_bytes)
-                except Exception as e:
-                    logger.error(f"[{self.stream_id}] Error distributing frame to client: {e}")
-                    clients_to_remove.append(client)
-        
-            # Remove problematic clients
-            for client in clients_to_remove:
-                self.clients.discard(client)
+        self.last_part = part
+        
+        # One store into the shared ring; clients pick it up themselves, no per-client work or lock
+        self.ring.publish((frame_bytes, part))
+
+    def acquire_mp4_encoder(self):
+        """Register an MP4 client, starting the shared encoder if it isn't running"""
+        with self.mp4_lock:
+            self.mp4_clients += 1
+            if self.mp4_process is None:
+                self._start_mp4_encoder()
+        notify_status_change()
+
+    def release_mp4_encoder(self):
+        """Unregister an MP4 client, stopping the encoder after the last one leaves"""
+        with self.mp4_lock:
+            self.mp4_clients -= 1
+            if self.mp4_clients == 0 and self.mp4_process is not None:
+                self._stop_mp4_encoder()
+        notify_status_change()
+
+    def _start_mp4_encoder(self):
+        """Start FFmpeg turning the JPEG frames into MP4 fragments (called with mp4_lock held)"""
+        self.mp4_init = None
+        self.mp4_process = subprocess.Popen([
+            'ffmpeg',
+            '-loglevel', 'error',
+            '-f', 'image2pipe',
+            '-vcodec', 'mjpeg',
+            '-r', '25',
+            '-i', '-',
+            '-c:v', 'libx264',
+            '-preset', 'ultrafast',
+            '-tune', 'zerolatency',
+            '-f', 'mp4',
+            '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+            '-'
+        ], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        
+        # The encoder reads the JPEG ring like any viewer, so frames keep being encoded for it
+        self.mp4_feeder = self.add_client()
+        threading.Thread(target=self._mp4_feed_worker, args=(self.mp4_process, self.mp4_feeder), daemon=True).start()
+        threading.Thread(target=self._mp4_reader_worker, args=(self.mp4_process,), daemon=True).start()
+        logger.info(f"[{self.stream_id}] MP4 encoder started")
+
+    def _stop_mp4_encoder(self):
+        """Stop the shared encoder (called with mp4_lock held)"""
+        self.remove_client(self.mp4_feeder)
+        try:
+            self.mp4_process.stdin.close()
+        except Exception:
+            pass
+        process = self.mp4_process
+        process.terminate()
+        try:
+            process.wait(timeout=2)  # Reap it now rather than leave a zombie until Popen's cleanup
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        self.mp4_process = None
+        self.mp4_feeder = None
+        logger.info(f"[{self.stream_id}] MP4 encoder stopped")
+
+    def _mp4_feed_worker(self, process, client):
+        """Write JPEG frames into the encoder until it or the client goes away"""
+        try:
+            if self.last_frame:
+                process.stdin.write(self.last_frame)
+            for frame_bytes, _ in client.get_frames():
+                process.stdin.write(frame_bytes)
+        except (BrokenPipeError, ValueError, OSError):
+            pass  # Encoder stopped
+
+    def _mp4_reader_worker(self, process):
+        """Split the encoder output into the init segment and moof+mdat fragments"""
+        stdout = process.stdout
+        init_parts = []
+        fragment = []
+        try:
+            while True:
+                # Box header: 32-bit size and type, or size 1 followed by a 64-bit size
+                header = stdout.read(8)
+                if len(header) < 8:
+                    break
+                size, box_type = struct.unpack('>I4s', header)
+                if size == 1:
+                    large = stdout.read(8)
+                    header += large
+                    size = struct.unpack('>Q', large)[0]
+                body = stdout.read(size - len(header))
+                if len(body) < size - len(header):
+                    break
+                
+                if box_type in (b'ftyp', b'moov'):
+                    init_parts.append(header + body)
+                    if box_type == b'moov':
+                        self.mp4_init = b''.join(init_parts)
+                elif box_type == b'mdat':
+                    # A moof and its mdat make one fragment, each starting at a keyframe
+                    fragment.append(header + body)
+                    self.mp4_ring.publish(b''.join(fragment))
+                    fragment = []
+                else:
+                    fragment.append(header + body)
+        except (ValueError, OSError):
+            pass  # Pipe closed by _stop_mp4_encoder
+        
+        with self.mp4_lock:
+            if self.mp4_process is process:
+                # FFmpeg exited on its own: clean up and end the current clients' streams.
+                # The next client to connect starts a new encoder
+                logger.warning(f"[{self.stream_id}] MP4 encoder exited")
+                self._stop_mp4_encoder()
+                self.mp4_ring.publish(None)
 
     def _stream_worker(self):
         """Worker thread to continuously read frames from TCP stream"""
@@ -1768,22 +2337,26 @@ class StreamManager:
             while self.running and self.cap.isOpened():
                 frame, frame_bytes = self._read_frame()
                 
-                if frame is None or frame_bytes is None:
+                if frame is None:
                     # Connection error, break to reconnect
                     break
                 
                 # Process motion detection if enabled
                 if self.motion_detection and self.motion_analyzer:
                     try:
-                        self.motion_analyzer.process_frame(frame, frame_bytes)
+                        self.motion_analyzer.submit_frame(frame, frame_bytes)
                     except Exception as e:
                         logger.error(f"[{self.stream_id}] Motion detection error: {e}")
+                    # Push motion transitions to the status event stream
+                    if self.motion_analyzer.motion_detected != self.last_motion_status:
+                        self.last_motion_status = self.motion_analyzer.motion_detected
+                        notify_status_change()
                 
-                # Distribute frame to all clients
-                self._distribute_frame(frame_bytes)
+                # Distribute frame to all clients (if any are watching)
+                if frame_bytes is not None:
+                    self._distribute_frame(frame_bytes)
                 
-                # Small sleep to prevent overwhelming the system
-                time.sleep(0.01)
+                # No sleep: cap.read() blocks until the camera delivers the next frame
             
             # Clean up
             if self.cap:
@@ -1808,11 +2381,11 @@ def generate_h264_frames(stream_manager: StreamManager):
         
         # Send any buffered frame first (if available)
         if stream_manager.last_frame:
-            yield stream_manager.last_frame
+            yield bytes(stream_manager.last_frame)
         
-        # Stream new frames as they arrive
-        for frame in client.get_frames():
-            yield frame
+        # Stream new frames as they arrive (the server writes bytes, frames are memoryviews)
+        for frame, _ in client.get_frames():
+            yield bytes(frame)
             
     except GeneratorExit:
         logger.info(f"[{stream_manager.stream_id}] Client disconnected (generator exit)")
@@ -1822,29 +2395,100 @@ def generate_h264_frames(stream_manager: StreamManager):
         # Always remove client when done
         stream_manager.remove_client(client)
 
+# Rendered index page per username as (utf-8 body, brotli body, ETag); only the stream
+# list and username vary, so it is cleared whenever streams are added or removed
+_index_cache = {}
+
+def render_index(username):
+    """Return the cached index page bytes and ETag for a user, rendering them on first use"""
+    cached = _index_cache.get(username)
+    if cached is None:
+        body = HTML_TEMPLATE_COMPILED.render(config=CONFIG, username=username).encode('utf-8')
+        # Compressed once at the highest quality, every later request reuses it
+        cached = (body, brotli.compress(body, quality=11), hashlib.sha1(body).hexdigest())
+        _index_cache[username] = cached
+    return cached
+
 # Flask routes - all protected with @login_required
 @app.route('/')
 @login_required
 #@log_access
 def index():
-    return render_template_string(HTML_TEMPLATE, config=CONFIG, username=request.user['username'])
+    return html_response(*render_index(request.user['username']))
     
+# Parsed list.txt, reloaded only when the file's mtime changes
+_links_cache = {'mtime': None, 'links': []}
+
 @app.route('/api/youtube-links', methods=['GET'])
 @login_required
 def get_youtube_links():
     """Get the list of YouTube links from list.txt"""
     try:
         links_file = "list.txt"
-        if os.path.exists(links_file):
-            with open(links_file, 'r', encoding='utf-8') as f:
-                links = [line.strip() for line in f.readlines() if line.strip()]
-            return {'links': links}
-        else:
+        try:
+            mtime = os.stat(links_file).st_mtime_ns
+        except FileNotFoundError:
+            _links_cache.update(mtime=None, links=[])
             return {'links': []}
+        if mtime != _links_cache['mtime']:
+            with open(links_file, 'r', encoding='utf-8') as f:
+                links = [line.strip() for line in f if line.strip()]
+            _links_cache.update(mtime=mtime, links=links)
+        return {'links': _links_cache['links']}
     except Exception as e:
         logger.error(f"Error reading YouTube links: {e}")
         return {'links': []}
 
+# Send buffer for streaming client sockets: a few viewer frames in flight
+STREAM_SNDBUF = 1 << 20
+
+def tune_stream_socket():
+    """Set TCP_NODELAY and a larger send buffer on the current streaming connection"""
+    # Only the werkzeug server exposes the socket; other servers are left as they are
+    sock = request.environ.get('werkzeug.socket')
+    if sock is None:
+        return
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, STREAM_SNDBUF)
+    except OSError as e:
+        logger.warning(f"Could not tune stream socket: {e}")
+
+# MJPEG multipart framing, built once. A part is
+# _PART_PREFIX + length + _PART_MID + JPEG + _PART_TAIL, the tail opening the next part
+_MJPEG_BOUNDARY = b'--frame\r\n'
+_PART_PREFIX = b'Content-Type: image/jpeg\r\nContent-Length: '
+_PART_MID = b'\r\n\r\n'
+_PART_TAIL = b'\r\n' + _MJPEG_BOUNDARY
+_OLD_PART_HEADER = _MJPEG_BOUNDARY + b'Content-Type: image/jpeg\r\n\r\n'  # h264_feed_old, no length
+
+# Response arguments of the streaming routes, built once instead of per connection
+_MJPG_RESP_KW = {
+    'mimetype': 'multipart/x-mixed-replace; boundary=frame',
+    'headers': (
+        ('Cache-Control', 'no-cache, private, no-store, must-revalidate, max-age=0'),
+        ('Connection', 'keep-alive'),
+        ('X-Accel-Buffering', 'no'),
+        ('Pragma', 'no-cache'),
+        ('Expires', '0'),
+    )
+}
+_OLD_MJPG_RESP_KW = {
+    'mimetype': 'multipart/x-mixed-replace; boundary=frame',
+    'headers': (
+        ('Cache-Control', 'no-cache'),
+        ('Connection', 'keep-alive'),
+        ('X-Accel-Buffering', 'no'),
+    )
+}
+_MP4_RESP_KW = {
+    'mimetype': 'video/mp4',
+    'headers': (
+        ('Cache-Control', 'no-cache'),
+        ('Connection', 'keep-alive'),
+    )
+}
+
 @app.route('/h264_feed/<stream_id>')
 @login_required
 def h264_feed(stream_id):
@@ -1869,17 +2513,13 @@ def h264_feed_old(stream_id):
         try:
             logger.info(f"[{stream_manager.stream_id}] Starting MJPEG stream for client")
             
-            # Send multipart header
-            boundary = 'frame'
-            headers = f'--{boundary}\r\nContent-Type: image/jpeg\r\n\r\n'
-            
             # Send any buffered frame first
             if stream_manager.last_frame:
-                yield headers.encode() + stream_manager.last_frame
+                yield _OLD_PART_HEADER + stream_manager.last_frame
             
             # Stream new frames as they arrive
-            for frame_bytes in client.get_frames():
-                multipart_frame = headers.encode() + frame_bytes
+            for frame_bytes, _ in client.get_frames():
+                multipart_frame = _OLD_PART_HEADER + frame_bytes
                 yield multipart_frame
                 
         except GeneratorExit:
@@ -1890,15 +2530,7 @@ def h264_feed_old(stream_id):
             # Always remove client when done
             stream_manager.remove_client(client)
     
-    return Response(
-        generate_mjpeg(),
-        mimetype='multipart/x-mixed-replace; boundary=frame',
-        headers={
-            'Cache-Control': 'no-cache',
-            'Connection': 'keep-alive',
-            'X-Accel-Buffering': 'no'
-        }
-    )
+    return Response(generate_mjpeg(), **_OLD_MJPG_RESP_KW)
 
 
 @app.route('/mp4_feed/<stream_id>')
@@ -1911,76 +2543,42 @@ def mp4_feed(stream_id):
         return "Stream not found", 404
     
     stream_manager = stream_managers[stream_id]
+    tune_stream_socket()
     
     def generate_mp4_fragments():
-        """Generate MP4 fragments using FFmpeg"""
-        client = stream_manager.add_client()
+        """Stream the shared encoder's output: init segment, then whole fragments"""
+        stream_manager.acquire_mp4_encoder()
+        client = StreamClient(stream_manager.mp4_ring)
         
         try:
             logger.info(f"[{stream_manager.stream_id}] Starting MP4 fragment stream for client")
             
-            # Start FFmpeg to convert JPEG frames to MP4 fragments
-            process = subprocess.Popen([
-                'ffmpeg',
-                '-y',
-                '-f', 'image2pipe',
-                '-vcodec', 'mjpeg',
-                '-r', '25',
-                '-i', '-',
-                '-c:v', 'libx264',
-                '-preset', 'ultrafast',
-                '-tune', 'zerolatency',
-                '-f', 'mp4',
-                '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
-                '-'
-            ], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            
-            # Send any buffered frame first
-            if stream_manager.last_frame:
-                process.stdin.write(stream_manager.last_frame)
-            
-            # Stream new frames to FFmpeg and get MP4 output
-            for frame_bytes in client.get_frames():
-                process.stdin.write(frame_bytes)
-                
-                # Read output from FFmpeg
-                while True:
-                    chunk = process.stdout.read(4096)
-                    if not chunk:
-                        break
-                    yield chunk
+            # After a fresh start, the init segment is ready by the time the first fragment is
+            frames = client.get_frames()
+            first_fragment = None
+            while stream_manager.mp4_init is None:
+                first_fragment = next(frames)
+                if first_fragment is None:
+                    return  # Encoder stopped before producing anything
+            yield stream_manager.mp4_init
+            if first_fragment is not None:
+                yield first_fragment
+            
+            # Fragments from here on; each starts at a keyframe, so joining mid-stream is fine
+            for fragment in frames:
+                if fragment is None:
+                    break  # Encoder stopped
+                yield fragment
                     
         except GeneratorExit:
             logger.info(f"[{stream_manager.stream_id}] Client disconnected (generator exit)")
-            try:
-                process.stdin.close()
-                process.terminate()
-            except:
-                pass
         except Exception as e:
             logger.error(f"[{stream_manager.stream_id}] MP4 fragment generation error: {e}")
-            try:
-                process.stdin.close()
-                process.terminate()
-            except:
-                pass
         finally:
-            # Always remove client when done
-            stream_manager.remove_client(client)
-            try:
-                process.stdin.close()
-                process.terminate()
-            except:
-                pass
+            client.connected = False
+            stream_manager.release_mp4_encoder()
     
-    return Response(
-        generate_mp4_fragments(),
-        mimetype='video/mp4',
-        headers={
-            'Cache-Control': 'no-cache',
-            'Connection': 'keep-alive'
-        }
-    )
+    return Response(generate_mp4_fragments(), **_MP4_RESP_KW)
     
 @app.route('/mjpg_feed/<stream_id>')
 @login_required
@@ -1992,6 +2590,7 @@ def mjpg_feed(stream_id):
         return "Stream not found", 404
     
     stream_manager = stream_managers[stream_id]
+    tune_stream_socket()
     
     def generate_mjpg():
         """Generate proper MJPEG stream with boundaries - Chrome compatible"""
@@ -2000,26 +2599,19 @@ def mjpg_feed(stream_id):
         try:
             logger.info(f"[{stream_manager.stream_id}] Starting MJPEG stream for Chrome client")
             
-            # Define multipart boundary
-            boundary = 'frame'
-            
-            # Send initial content type header
-            yield (f'--{boundary}\r\n').encode()
+            # Send initial boundary
+            yield _MJPEG_BOUNDARY
             
-            # Send any buffered frame first
-            if stream_manager.last_frame:
-                yield (f'Content-Type: image/jpeg\r\n'
-                       f'Content-Length: {len(stream_manager.last_frame)}\r\n'
-                       f'\r\n').encode() + stream_manager.last_frame + b'\r\n'
-                yield (f'--{boundary}\r\n').encode()
+            # Each part (headers, JPEG and the next boundary) comes prebuilt from the stream
+            # worker and is yielded as one chunk, so the server does a single write per frame
+            last_part = stream_manager.last_part
+            if last_part:
+                # Send any buffered frame first
+                yield last_part
             
             # Stream new frames as they arrive
-            for frame_bytes in client.get_frames():
-                multipart_data = (f'Content-Type: image/jpeg\r\n'
-                                 f'Content-Length: {len(frame_bytes)}\r\n'
-                                 f'\r\n').encode() + frame_bytes + b'\r\n'
-                yield multipart_data
-                yield (f'--{boundary}\r\n').encode()
+            for _, part in client.get_frames():
+                yield part
                 
         except GeneratorExit:
             logger.info(f"[{stream_manager.stream_id}] Chrome client disconnected (generator exit)")
@@ -2029,17 +2621,7 @@ def mjpg_feed(stream_id):
             # Always remove client when done
             stream_manager.remove_client(client)
     
-    return Response(
-        generate_mjpg(),
-        mimetype='multipart/x-mixed-replace; boundary=frame',
-        headers={
-            'Cache-Control': 'no-cache, private, no-store, must-revalidate, max-age=0',
-            'Connection': 'keep-alive',
-            'X-Accel-Buffering': 'no',
-            'Pragma': 'no-cache',
-            'Expires': '0'
-        }
-    )
+    return Response(generate_mjpg(), **_MJPG_RESP_KW)
     
 @app.route('/api/streams', methods=['GET'])
 @login_required
@@ -2066,6 +2648,69 @@ def get_motion_status(stream_id):
     motion_detected = stream_managers[stream_id].get_motion_status()
     return {'motion_detected': motion_detected}
 
+@app.route('/api/streams/<stream_id>/status', methods=['GET'])
+@login_required
+def get_stream_status(stream_id):
+    """Get client count and motion detection status for a stream in one call"""
+    if stream_id not in stream_managers:
+        return {'error': 'Stream not found'}, 404
+    
+    stream_manager = stream_managers[stream_id]
+    return {
+        'client_count': stream_manager.get_client_count(),
+        'motion_detected': stream_manager.get_motion_status()
+    }
+
+@app.route('/api/streams/<stream_id>/quality', methods=['GET'])
+@login_required
+def get_stream_quality(stream_id):
+    """Current adaptive JPEG quality and average frame size for a stream"""
+    if stream_id not in stream_managers:
+        return {'error': 'Stream not found'}, 404
+    
+    stream_manager = stream_managers[stream_id]
+    return {
+        'jpeg_quality': stream_manager.jpeg_quality,
+        'avg_frame_bytes': round(stream_manager.jpeg_size_ewma[stream_manager.jpeg_quality])
+    }
+
+def stream_status_snapshot():
+    """Client count and motion status of every stream"""
+    return {
+        stream_id: {
+            'client_count': stream_manager.get_client_count(),
+            'motion_detected': stream_manager.get_motion_status()
+        }
+        for stream_id, stream_manager in list(stream_managers.items())
+    }
+
+@app.route('/api/streams/status', methods=['GET'])
+@login_required
+def get_all_stream_status():
+    """Get client count and motion status of every stream (polling fallback for /api/streams/events)"""
+    return stream_status_snapshot()
+
+@app.route('/api/streams/events', methods=['GET'])
+@login_required
+def stream_status_events():
+    """Server-Sent Events stream of stream status, sent whenever it changes"""
+    def generate_events():
+        version = -1
+        while True:
+            with status_changed:
+                if version == status_version:
+                    status_changed.wait(timeout=15)
+                changed = version != status_version
+                version = status_version
+            if changed:
+                yield f"data: {orjson.dumps(stream_status_snapshot()).decode()}\n\n"
+            else:
+                # Comment line, keeps proxies from closing an idle connection
+                yield ": keepalive\n\n"
+    
+    return Response(generate_events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/streams/add', methods=['POST'])
 @login_required
 def api_add_stream():
@@ -2080,6 +2725,7 @@ def api_remove_stream(stream_id):
         stream_managers.pop(stream_id)
         if stream_id in CONFIG['streams']:
             CONFIG['streams'].pop(stream_id)
+        _index_cache.clear()
         return {'status': 'success', 'message': f'Stream {stream_id} removed'}
     else:
         return {'status': 'error', 'message': 'Stream not found'}, 404
@@ -2106,6 +2752,7 @@ def add_stream(stream_id, host, port, name=None, motion_detection=False, output_
     stream_manager = StreamManager(stream_id, host, port, motion_detection, output_directory)
     stream_managers[stream_id] = stream_manager
     stream_manager.start()
+    _index_cache.clear()
     
     logger.info(f"Added new stream: {stream_id} ({host}:{port}) with motion detection: {motion_detection}")
     return True
@@ -2118,6 +2765,7 @@ def remove_stream(stream_id):
         stream_managers[stream_id].stop()
         stream_managers.pop(stream_id)
         CONFIG['streams'].pop(stream_id, None)
+        _index_cache.clear()
         logger.info(f"Removed stream: {stream_id}")
         return True
     return False
@@ -2136,8 +2784,15 @@ def initialize_streams():
             logger.info(f"Initialized stream: {stream_id} (motion detection: {motion_detection})")
 
 
-initialize_loggers()  
+if __name__ != '__mp_main__':  # Not in the bcrypt workers
+    initialize_loggers()
 if __name__ == '__main__':
+    BCRYPT_POOL = ProcessPoolExecutor(max_workers=os.cpu_count(),
+                                      mp_context=multiprocessing.get_context('forkserver'))
+    # Start the workers now rather than on the first login
+    list(BCRYPT_POOL.map(bcrypt.gensalt, [4] * os.cpu_count()))
+    atexit.register(BCRYPT_POOL.shutdown)
+    calibrate_bcrypt_cost()
     initialize_passwords()
     initialize_streams()
     
@@ -2146,9 +2801,8 @@ if __name__ == '__main__':
     # add_stream('stream3', '192.168.8.213', 42069, 'Garage Camera', motion_detection=False)
     
     logger.info("Starting H264 Flask streaming server on http://0.0.0.0:42069")
-    logger.info(f"Authentication: {'ENABLED' if AUTH_CONFIG['enabled'] else 'DISABLED'}")
-    if AUTH_CONFIG['enabled']:
-        logger.info("Default users: admin/same as switch, viewer/pw")
-        logger.info("CHANGE DEFAULT PASSWORDS IN PRODUCTION!")
+    logger.info(f"Authentication: {'ENABLED' if AUTH_ENABLED else 'DISABLED'}")
+    if AUTH_ENABLED:
+        logger.info("Initial passwords are read from INIT_ADMIN_PASSWORD / INIT_USER_PASSWORD")
     
     app.run(host='127.0.0.1', port=42069, threaded=True)